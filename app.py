@@ -1,13 +1,54 @@
+import atexit
+import copy
+import cProfile
+import csv
+import functools
+import gc
+import gzip
+import hashlib
+import json
+import math
+import mimetypes
+import multiprocessing
 import os
+import queue
+import random
+import re
+import shutil
 import sqlite3
-from datetime import datetime
-from io import BytesIO
+import tempfile
+import threading
+import time
+import unicodedata
+import warnings
+import weakref
+import zipfile
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from types import MappingProxyType
+
+# Medido até o fim do módulo (ver IMPORT_SECONDS, exposto em /ready).
+_IMPORT_STARTED = time.perf_counter()
 
 from flask import (
-    Flask, render_template, request, redirect, url_for, flash, send_file, jsonify
+    Flask, Response, render_template, request, redirect, url_for, flash, send_file, jsonify, session, g,
+    before_render_template, template_rendered,
 )
 
-from docx import Document
+import click
+
+try:
+    import numpy as np
+except ImportError:  # sem NumPy a busca semântica cai no simple_search
+    np = None
+
+try:
+    import brotli
+except ImportError:  # sem brotli, as respostas saem só em gzip
+    brotli = None
 
 # =====================================================
 # CONFIGURAÇÕES
@@ -20,6 +61,92 @@ DATA_DIR = os.path.abspath("./data")
 os.makedirs(DATA_DIR, exist_ok=True)
 DB_PATH = os.path.join(DATA_DIR, "ethospsi.sqlite3")
 
+# Ajustes do SQLite (podem ser sobrescritos por variáveis de ambiente)
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_KB = int(os.environ.get("DB_CACHE_KB", "8192"))
+DB_MMAP_BYTES = int(os.environ.get("DB_MMAP_BYTES", str(64 * 1024 * 1024)))
+
+HISTORY_PAGE_SIZE = 10
+
+# Histórico: gravação em segundo plano (write-behind). Use 0 para gravar na hora.
+app.config["HISTORY_WRITE_BEHIND"] = os.environ.get("HISTORY_WRITE_BEHIND", "1") == "1"
+HISTORY_QUEUE_MAX = int(os.environ.get("HISTORY_QUEUE_MAX", "1000"))
+HISTORY_BATCH_MAX = int(os.environ.get("HISTORY_BATCH_MAX", "100"))
+HISTORY_FLUSH_SECONDS = float(os.environ.get("HISTORY_FLUSH_SECONDS", "0.5"))
+HISTORY_EXPORT_BATCH = int(os.environ.get("HISTORY_EXPORT_BATCH", "1000"))
+
+# Retenção do histórico: 0 desliga. Modo "delete" apaga; "archive" move para ARCHIVE_DB_PATH.
+HISTORY_RETENTION_DAYS = int(os.environ.get("HISTORY_RETENTION_DAYS", "0"))
+HISTORY_RETENTION_MODE = os.environ.get("HISTORY_RETENTION_MODE", "delete")
+HISTORY_RETENTION_BATCH = int(os.environ.get("HISTORY_RETENTION_BATCH", "500"))
+ARCHIVE_DB_PATH = os.path.join(DATA_DIR, "ethospsi-archive.sqlite3")
+MAINTENANCE_INTERVAL_SECONDS = int(os.environ.get("MAINTENANCE_INTERVAL_SECONDS", "3600"))
+
+# Agregado "perguntas mais feitas": buckets diários; mais antigos que isso viram mensais.
+QUESTION_STATS_DAILY_DAYS = int(os.environ.get("QUESTION_STATS_DAILY_DAYS", "90"))
+TOP_QUESTIONS_HOME_DAYS = int(os.environ.get("TOP_QUESTIONS_HOME_DAYS", "30"))
+
+# Ingestão de PDFs
+UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "100"))
+PDF_PAGES_PER_TASK = 8
+PDF_MAX_WORKERS = int(os.environ.get("PDF_MAX_WORKERS", str(os.cpu_count() or 1)))
+CHUNK_MAX_CHARS = 1200
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES
+
+# Cache dos .docx gerados (por worker)
+DOCX_CACHE_MAX_BYTES = int(os.environ.get("DOCX_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Cache HTTP (segundos)
+QA_MAX_AGE = int(os.environ.get("QA_MAX_AGE", "300"))
+PAGE_MAX_AGE = int(os.environ.get("PAGE_MAX_AGE", "600"))
+STATIC_MAX_AGE = 365 * 24 * 3600  # arquivos com hash no nome nunca mudam
+
+# Compressão das respostas (gzip; brotli se instalado)
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", "6"))
+
+# Perguntas: tamanho máximo aceito (form da home, /qa)
+QUESTION_MAX_CHARS = int(os.environ.get("QUESTION_MAX_CHARS", "500"))
+
+# Autocomplete (/suggest)
+SUGGEST_HISTORY_TOP = int(os.environ.get("SUGGEST_HISTORY_TOP", "200"))
+SUGGEST_REFRESH_SECONDS = int(os.environ.get("SUGGEST_REFRESH_SECONDS", "300"))
+SUGGEST_MAX_K = 10
+# A trie guarda sufixos que começam nas primeiras SUGGEST_MAX_WORDS palavras,
+# cortados em SUGGEST_SUFFIX_CHARS: custo por pergunta limitado, não quadrático.
+SUGGEST_MAX_WORDS = 30
+SUGGEST_SUFFIX_CHARS = 40
+
+# Honorários: cenários (grade de faixas ou Monte-Carlo das faltas)
+SWEEP_MAX_SCENARIOS = int(os.environ.get("SWEEP_MAX_SCENARIOS", "200000"))
+
+# Exportação em lote (.zip)
+EXPORT_MAX_WORKERS = int(os.environ.get("EXPORT_MAX_WORKERS", "4"))
+
+# API em lote (/api/v1/...): itens por requisição
+API_MAX_ITEMS = int(os.environ.get("API_MAX_ITEMS", "1000"))
+
+# Métricas (/metrics): cada worker grava as suas em METRICS_DIR/<pid>.json
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+
+# Profiler de requests lentos (opt-in): 0 desliga
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0.05"))
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
+
+# Coleta das fontes oficiais (LINKS_OFICIAIS)
+FETCH_CACHE_DIR = os.path.join(DATA_DIR, "http_cache")
+FETCH_INTERVAL_SECONDS = int(os.environ.get("FETCH_INTERVAL_SECONDS", str(24 * 3600)))
+FETCH_TIMEOUT = (5, 30)  # (conexão, leitura) em segundos
+
+# Índice TF-IDF (arquivos .npy compartilhados entre workers via mmap)
+TFIDF_DIR = os.path.join(DATA_DIR, "tfidf")
+TFIDF_REFRESH_SECONDS = int(os.environ.get("TFIDF_REFRESH_SECONDS", "60"))
+
 # =====================================================
 # LINKS OFICIAIS
 # =====================================================
@@ -99,6 +226,234 @@ QUICK_QUESTIONS = [
     "Como agir em suspeita de violência (rede de proteção)?",
 ]
 
+# =====================================================
+# MÉTRICAS E PROFILING
+# =====================================================
+# Por request: latência (histograma por rota), tempo por fase (funções marcadas
+# com @timed e renderização de template) e consultas SQL (contadas em
+# _PooledConnection.execute). Respostas em streaming contam até o início do corpo.
+# Cada worker acumula em memória e grava METRICS_DIR/<pid>.json de tempos em
+# tempos; /metrics soma os arquivos de todos os workers, inclusive os que já
+# morreram, para que os contadores nunca voltem para trás.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics_local = threading.local()
+_metrics_lock = threading.Lock()
+_metrics = {
+    "requests": defaultdict(int),                                      # (rota, método, status) -> n
+    "latency": defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 2)),  # (rota, método) -> buckets, +Inf, soma em μs
+    "phases": defaultdict(lambda: [0.0, 0]),                           # (rota, fase) -> segundos, chamadas
+    "sql": defaultdict(lambda: [0, 0.0]),                              # (rota,) -> consultas, segundos
+}
+_metrics_state = {"next_flush": 0.0}
+
+def timed(phase: str):
+    """Soma o tempo da função na fase `phase` do request atual (fora de request, não mede)."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            req = getattr(_metrics_local, "req", None)
+            if req is None:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                req["phases"][phase] += time.perf_counter() - t0
+        return wrapper
+    return deco
+
+def _record_sql(seconds: float):
+    req = getattr(_metrics_local, "req", None)
+    if req is not None:
+        req["sql_n"] += 1
+        req["sql_s"] += seconds
+
+@before_render_template.connect_via(app)
+def _template_started(sender, template, context, **extra):
+    req = getattr(_metrics_local, "req", None)
+    if req is not None:
+        req["tpl_t0"] = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _template_finished(sender, template, context, **extra):
+    req = getattr(_metrics_local, "req", None)
+    if req is not None and req.get("tpl_t0"):
+        req["phases"]["template"] += time.perf_counter() - req.pop("tpl_t0")
+
+@app.before_request
+def _metrics_start():
+    req = {"t0": time.perf_counter(), "phases": defaultdict(float), "sql_n": 0, "sql_s": 0.0,
+           "status": 500, "profile": None}
+    if PROFILE_SLOW_MS > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+            req["profile"] = prof
+        except ValueError:  # outro profiler já ativo nesta thread
+            pass
+    _metrics_local.req = req
+
+@app.after_request
+def _metrics_status(response):
+    req = getattr(_metrics_local, "req", None)
+    if req is not None:
+        req["status"] = response.status_code
+    return response
+
+@app.teardown_request
+def _metrics_finish(exc):
+    req = getattr(_metrics_local, "req", None)
+    _metrics_local.req = None
+    if req is None:
+        return
+    elapsed = time.perf_counter() - req["t0"]
+    route = request.url_rule.rule if request.url_rule is not None else "<sem rota>"
+    method = request.method
+    with _metrics_lock:
+        _metrics["requests"][(route, method, str(req["status"]))] += 1
+        hist = _metrics["latency"][(route, method)]
+        for i, le in enumerate(LATENCY_BUCKETS):
+            if elapsed <= le:
+                hist[i] += 1
+                break
+        else:
+            hist[len(LATENCY_BUCKETS)] += 1
+        hist[-1] += int(elapsed * 1e6)
+        for phase, seconds in req["phases"].items():
+            acc = _metrics["phases"][(route, phase)]
+            acc[0] += seconds
+            acc[1] += 1
+        sql = _metrics["sql"][(route,)]
+        sql[0] += req["sql_n"]
+        sql[1] += req["sql_s"]
+    if req["profile"] is not None:
+        req["profile"].disable()
+        if elapsed * 1000 >= PROFILE_SLOW_MS:
+            _dump_profile(req["profile"], route, elapsed)
+    if time.monotonic() >= _metrics_state["next_flush"]:
+        flush_metrics()
+
+def _dump_profile(prof: cProfile.Profile, route: str, elapsed: float):
+    """Grava o .prof (abrir com `python -m pstats` ou snakeviz) e mantém só os PROFILE_KEEP mais novos."""
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        name = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}-{slug}-{int(elapsed * 1000)}ms.prof"
+        prof.dump_stats(os.path.join(PROFILE_DIR, name))
+        files = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".prof"))
+        for old in files[:-PROFILE_KEEP]:
+            os.remove(os.path.join(PROFILE_DIR, old))
+    except OSError:
+        app.logger.exception("Não foi possível gravar o profile de %s", route)
+
+def _metrics_snapshot() -> dict:
+    with _metrics_lock:
+        return {name: [[list(k), list(v) if isinstance(v, list) else v] for k, v in table.items()]
+                for name, table in _metrics.items()}
+
+def flush_metrics():
+    """Grava as métricas deste worker em METRICS_DIR/<pid>.json (troca atômica)."""
+    _metrics_state["next_flush"] = time.monotonic() + METRICS_FLUSH_SECONDS
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=METRICS_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(_metrics_snapshot(), f)
+        os.replace(tmp, os.path.join(METRICS_DIR, f"{os.getpid()}.json"))
+    except OSError:
+        app.logger.exception("Não foi possível gravar as métricas")
+
+def _merge_metrics(total: dict, part: dict):
+    for name, rows in part.items():
+        table = total.setdefault(name, {})
+        for key, value in rows:
+            key = tuple(key)
+            if isinstance(value, list):
+                acc = table.setdefault(key, [0] * len(value))
+                table[key] = [a + b for a, b in zip(acc, value)]
+            else:
+                table[key] = table.get(key, 0) + value
+
+def collect_metrics() -> dict:
+    """Soma os arquivos de todos os workers (este é gravado antes)."""
+    flush_metrics()
+    total = {}
+    names = os.listdir(METRICS_DIR) if os.path.isdir(METRICS_DIR) else []
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                _merge_metrics(total, json.load(f))
+        except (OSError, ValueError):
+            continue  # arquivo sendo trocado ou corrompido: entra no próximo scrape
+    return total
+
+def _labels(**kw) -> str:
+    return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                          for k, v in kw.items()) + "}"
+
+def render_metrics(total: dict) -> str:
+    """Formato texto do Prometheus (0.0.4)."""
+    out = [
+        "# HELP ethospsi_requests_total Requests por rota, método e status.",
+        "# TYPE ethospsi_requests_total counter",
+    ]
+    for (route, method, status), n in sorted(total.get("requests", {}).items()):
+        out.append(f"ethospsi_requests_total{_labels(route=route, method=method, status=status)} {n}")
+    out += ["# HELP ethospsi_request_duration_seconds Latência por rota.",
+            "# TYPE ethospsi_request_duration_seconds histogram"]
+    for (route, method), hist in sorted(total.get("latency", {}).items()):
+        cumulative = 0
+        for le, n in zip(LATENCY_BUCKETS + ("+Inf",), hist[:-1]):
+            cumulative += n
+            out.append(f"ethospsi_request_duration_seconds_bucket{_labels(route=route, method=method, le=le)} {cumulative}")
+        out.append(f"ethospsi_request_duration_seconds_sum{_labels(route=route, method=method)} {hist[-1] / 1e6:.6f}")
+        out.append(f"ethospsi_request_duration_seconds_count{_labels(route=route, method=method)} {cumulative}")
+    out += ["# HELP ethospsi_phase_seconds Tempo por fase do request (answer, template, docx, ...).",
+            "# TYPE ethospsi_phase_seconds summary"]
+    for (route, phase), (seconds, n) in sorted(total.get("phases", {}).items()):
+        out.append(f"ethospsi_phase_seconds_sum{_labels(route=route, phase=phase)} {seconds:.6f}")
+        out.append(f"ethospsi_phase_seconds_count{_labels(route=route, phase=phase)} {n}")
+    out += ["# HELP ethospsi_sql_queries_total Consultas SQLite feitas durante requests.",
+            "# TYPE ethospsi_sql_queries_total counter"]
+    sql = sorted(total.get("sql", {}).items())
+    for (route,), (n, _) in sql:
+        out.append(f"ethospsi_sql_queries_total{_labels(route=route)} {n}")
+    out += ["# HELP ethospsi_sql_seconds_total Tempo gasto em consultas SQLite durante requests.",
+            "# TYPE ethospsi_sql_seconds_total counter"]
+    for (route,), (_, seconds) in sql:
+        out.append(f"ethospsi_sql_seconds_total{_labels(route=route)} {seconds:.6f}")
+    return "\n".join(out) + "\n"
+
+def metrics_summary(total: dict) -> list[dict]:
+    """Resumo por rota para o /admin: requests, média, p95 (limite do bucket) e SQL por request."""
+    sql = total.get("sql", {})
+    rows = []
+    for (route, method), hist in total.get("latency", {}).items():
+        count = sum(hist[:-1])
+        if not count:
+            continue
+        p95, cumulative = "+Inf", 0
+        for le, n in zip(LATENCY_BUCKETS, hist):
+            cumulative += n
+            if cumulative >= 0.95 * count:
+                p95 = f"≤ {le * 1000:g} ms"
+                break
+        rows.append({"route": route, "method": method, "count": count,
+                     "mean_ms": round(hist[-1] / 1000 / count, 2), "p95": p95})
+    for row in rows:
+        same_route = sum(r["count"] for r in rows if r["route"] == row["route"])
+        queries, seconds = sql.get((row["route"],), (0, 0.0))
+        row["sql_per_request"] = round(queries / same_route, 1) if same_route else 0
+        row["sql_ms_per_request"] = round(seconds * 1000 / same_route, 2) if same_route else 0
+    return sorted(rows, key=lambda r: -r["count"])
+
+@app.route("/metrics")
+def metrics():
+    return Response(render_metrics(collect_metrics()), mimetype="text/plain; version=0.0.4")
+
 # =====================================================
 # HELPERS DE RESPOSTA (HTML)
 # =====================================================
@@ -124,428 +479,1776 @@ def _make_answer(title: str, bullets: list[str], delicate: bool = True) -> str:
     """
 
 # =====================================================
-# BANCO DE DADOS DE RESPOSTAS (DICT)
-# =====================================================
-RESPOSTAS_DB = {
-    # --- SIGILO ---
-    "Até onde vai o sigilo?": _make_answer(
-        "O sigilo é inerente à profissão (Art. 9º do CEpp).",
-        [
-            "Protege a intimidade da pessoa, grupos ou organizações.",
-            "Não é absoluto: pode ser quebrado em situações de risco grave à vida (suicídio/homicídio), violência contra vulneráveis ou ordem judicial específica.",
-            "Mesmo na quebra, deve-se restringir as informações ao estritamente necessário."
-        ]
-    ),
-    "Quando posso quebrar o sigilo?": _make_answer(
-        "Situações de exceção (Art. 10º do CEpp).",
-        [
-            "Quando houver risco grave e iminente à vida (da pessoa ou terceiros).",
-            "Casos de violência contra criança, adolescente ou idoso (comunicação aos órgãos competentes).",
-            "Decisão judicial fundamentada (embora o psicólogo possa arguir sigilo se julgar prejudicial).",
-            "Em todos os casos, prestar apenas as informações estritamente necessárias."
-        ]
-    ),
-    "Posso confirmar para alguém que a pessoa é minha paciente?": _make_answer(
-        "Não. A própria existência do vínculo é sigilosa.",
-        [
-            "Confirmar o atendimento expõe a pessoa e viola o Art. 9º.",
-            "Resposta padrão: 'Por questões éticas, não posso confirmar nem negar atendimento a qualquer pessoa'.",
-            "Exceção: Se o paciente autorizar formalmente ou se for responsável legal de menor."
-        ]
-    ),
-    "Posso falar do caso com meu cônjuge ou amigo?": _make_answer(
-        "Não. Violação gravíssima de sigilo.",
-        [
-            "O Art. 9º veda a exposição da intimidade.",
-            "Mesmo trocando nomes, detalhes podem identificar o paciente.",
-            "Angústias do terapeuta devem ser tratadas em Supervisão ou Terapia Pessoal, nunca em conversas sociais."
-        ]
-    ),
-    "Como agir se um familiar pede informações do paciente?": _make_answer(
-        "Proteja o sigilo e o vínculo.",
-        [
-            "Para pacientes adultos: Não passe informações sem consentimento expresso.",
-            "Para crianças/adolescentes: Pais têm direito a feedback, mas não ao conteúdo detalhado das sessões (Art. 13º). Informe apenas o necessário para promover medidas em benefício.",
-            "Acolha a angústia da família, mas reafirme a ética."
-        ]
-    ),
-    "Como agir se o paciente pede segredo absoluto?": _make_answer(
-        "Alinhe expectativas (Contrato Terapêutico).",
-        [
-            "Explique que o sigilo é a regra, mas a lei obriga a quebra em risco de vida ou violência.",
-            "Isso constrói confiança e transparência desde o início.",
-            "Garanta que nada será revelado 'sem querer' ou por descuido."
-        ]
-    ),
-    "Até onde vai o sigilo em caso de crime?": _make_answer(
-        "O psicólogo não é investigador de polícia.",
-        [
-            "Crimes passados relatados em sessão (ex: roubo) estão sob sigilo.",
-            "Crimes em andamento ou futuros com risco à vida (ex: planejamento de homicídio/suicídio) ou contra vulneráveis exigem quebra de sigilo para proteção (Art. 10º).",
-            "Em dúvida, consulte o jurídico do CRP."
-        ]
-    ),
-
-    # --- PRONTUÁRIO / DOCUMENTOS ---
-    "Sou obrigada a fazer anotações?": _make_answer(
-        "Sim. O registro documental é obrigatório.",
-        [
-            "Resolução CFP 01/2009: É dever do psicólogo manter registro documental.",
-            "Serve para garantia de direitos do usuário, defesa do profissional e evolução do caso.",
-            "A falta de registro é infração ética frequente em fiscalizações."
-        ]
-    ),
-    "O que é obrigatório eu anotar no prontuário?": _make_answer(
-        "Conteúdo mínimo (Res. CFP 01/2009).",
-        [
-            "Identificação do usuário.",
-            "Avaliação da demanda e definição de objetivos.",
-            "Registro da evolução (datas, procedimentos, síntese do atendimento).",
-            "Encaminhamentos ou encerramento.",
-            "Não é necessário transcrever a sessão inteira (diário), apenas a síntese técnica."
-        ]
-    ),
-    "Paciente pediu para não registrar no prontuário": _make_answer(
-        "O registro é dever do psicólogo, não escolha do paciente.",
-        [
-            "Explique que é uma obrigação legal (Res. 01/2009).",
-            "Negocie o teor: você pode registrar de forma mais sintética, protegendo detalhes muito íntimos, mas mantendo a evolução técnica.",
-            "O prontuário pertence ao paciente, mas a guarda é do psicólogo."
-        ]
-    ),
-    "O paciente pode pedir cópia do prontuário?": _make_answer(
-        "Sim. É direito do usuário (Res. CFP 01/2009).",
-        [
-            "O paciente tem acesso integral às suas informações.",
-            "O psicólogo deve fornecer cópia ou acesso quando solicitado.",
-            "Se houver risco de o conteúdo causar dano (ex: surto psicótico ao ler), o profissional deve oferecer acompanhamento ou entrevista devolutiva para explicar o conteúdo."
-        ]
-    ),
-    "Por quanto tempo devo guardar prontuários?": _make_answer(
-        "Mínimo de 05 anos.",
-        [
-            "Resolução CFP 01/2009: Guarda mínima de 5 anos após o último atendimento.",
-            "Após esse prazo, podem ser incinerados ou destruídos de forma segura.",
-            "Para crianças, recomenda-se guardar até a maioridade (precaução jurídica)."
-        ]
-    ),
-    "Posso usar prontuários de forma digital?": _make_answer(
-        "Sim, com requisitos de segurança.",
-        [
-            "O sistema deve garantir sigilo, autenticidade e integridade.",
-            "Recomendado uso de Certificado Digital (ICP-Brasil) para assinatura.",
-            "Evite guardar em Word/Excel sem senha ou em nuvens públicas não seguras."
-        ]
-    ),
-    "Posso usar IA para escrever prontuário?": _make_answer(
-        "Extremo cuidado. Risco de violação de sigilo.",
-        [
-            "Não insira nomes ou dados identificáveis em IAs públicas (ChatGPT, Gemini, etc.), pois os dados podem ser tratados fora do seu controle.",
-            "A responsabilidade técnica do texto é 100% do psicólogo.",
-            "O uso deve ser apenas para auxílio na redação, nunca para análise clínica automática."
-        ]
-    ),
-
-    # --- DOCUMENTOS (Resolução 06/2019) ---
-    "Posso emitir laudo psicológico para processo?": _make_answer(
-        "Sim, se houver demanda e capacitação.",
-        [
-            "Deve seguir rigorosamente a Resolução CFP 06/2019.",
-            "O Laudo é resultado de Avaliação Psicológica. Não emita laudo apenas com base em psicoterapia.",
-            "Deve ser imparcial, objetivo e responder aos quesitos ou demanda específica."
-        ]
-    ),
-    "Posso emitir declaração de comparecimento?": _make_answer(
-        "Sim. É o documento mais simples.",
-        [
-            "Resolução 06/2019: Atesta apenas o comparecimento (dia, hora, duração).",
-            "Não deve conter diagnóstico (CID) ou sintomas, a menos que estritamente necessário e solicitado.",
-            "Serve para justificar falta no trabalho/escola."
-        ]
-    ),
-    "Posso emitir relatório para escola?": _make_answer(
-        "Sim, focado no processo de aprendizagem.",
-        [
-            "Não exponha a intimidade familiar para a escola.",
-            "O foco deve ser: como as questões emocionais impactam a aprendizagem ou comportamento escolar.",
-            "Sempre peça autorização dos responsáveis e, se possível, mostre o documento a eles antes de enviar."
-        ]
-    ),
-    "Posso colocar CID em relatório?": _make_answer(
-        "Apenas com autorização e se tecnicamente justificado.",
-        [
-            "O diagnóstico pertence ao paciente. Só coloque CID se o paciente solicitar ou autorizar.",
-            "Em documentos para planos de saúde ou INSS, geralmente é exigido, mas discuta com o paciente antes.",
-            "Evite rotulação desnecessária."
-        ]
-    ),
-    "Posso cobrar por relatório psicológico?": _make_answer(
-        "Depende do contexto.",
-        [
-            "Se for um relatório simples de evolução do tratamento, geralmente entende-se incluso no serviço.",
-            "Se for um Laudo ou Avaliação Psicológica extra (documento complexo), pode ser cobrado à parte, desde que acordado previamente no Contrato."
-        ]
-    ),
-
-    # --- RELACIONAMENTOS DUAIS ---
-    "Posso atender amigos?": _make_answer(
-        "Não. Veda relação que interfira na objetividade.",
-        [
-            "Art. 2º, j: Vedado estabelecer relação que possa interferir negativamente.",
-            "A intimidade prévia contamina a transferência e a neutralidade técnica.",
-            "Encaminhe para um colega de confiança."
-        ]
-    ),
-    "Posso atender familiares?": _make_answer(
-        "Não. Configura relação dual/múltipla.",
-        [
-            "Mesma lógica dos amigos: falta de isenção e risco de confusão de papéis.",
-            "O vínculo pessoal pré-existente impede o vínculo profissional ético.",
-            "Encaminhamento é a conduta correta."
-        ]
-    ),
-    "Posso atender familiares de ex-pacientes?": _make_answer(
-        "Cuidado. Avalie caso a caso.",
-        [
-            "Não é explicitamente proibido, mas pode gerar conflito se as histórias se cruzarem.",
-            "Se o ex-paciente foi atendido há pouco tempo ou se o vínculo familiar é muito próximo, melhor evitar.",
-            "Priorize a qualidade do serviço e o sigilo."
-        ]
-    ),
-    "Posso ir a eventos sociais em que meu paciente esta?": _make_answer(
-        "Situação delicada. Preserve o enquadre.",
-        [
-            "Se for evento grande (show, palestra), ok. Se for íntimo (aniversário na casa de amigo comum), evite.",
-            "Se encontrar: cumprimente discretamente, não puxe assunto terapêutico.",
-            "Proteja o sigilo: não deixe transparecer para outros que é seu paciente."
-        ]
-    ),
-    "Posso seguir paciente no Instagram?": _make_answer(
-        "Não recomendado. Proteja o setting.",
-        [
-            "Ter acesso à vida pessoal do paciente fora da sessão pode enviesar a escuta.",
-            "O paciente ter acesso à sua vida pessoal pode interferir na transferência.",
-            "Perfis profissionais são ok, mas evite seguir de volta (seguir o paciente) para manter a assimetria da relação."
-        ]
-    ),
-
-    # --- ONLINE / TECNOLOGIA ---
-    "Preciso de contrato para terapia online?": _make_answer(
-        "Altamente recomendado.",
-        [
-            "Estabeleça regras claras sobre plataforma, falhas de conexão, privacidade do ambiente e pagamentos.",
-            "Define o que acontece se a internet cair (remarca? cobra?).",
-            "Protege ambas as partes."
-        ]
-    ),
-    "Como garantir sigilo no atendimento online?": _make_answer(
-        "Medidas técnicas e ambientais.",
-        [
-            "Use fones de ouvido.",
-            "Esteja em sala fechada e isolada acusticamente.",
-            "Peça para o paciente fazer o mesmo (garantir que ele esteja sozinho).",
-            "Evite gravar sessões sem necessidade extrema e consentimento."
-        ]
-    ),
-    "Posso atender paciente dirigindo?": _make_answer(
-        "Não. Risco à segurança e falta de foco.",
-        [
-            "A sessão exige atenção plena e ambiente seguro.",
-            "Dirigir exige atenção ao trânsito. Fazer os dois coloca o paciente em risco físico.",
-            "Interrompa a sessão e peça para ele estacionar ou remarcar."
-        ]
-    ),
-
-    # --- HONORÁRIOS ---
-    "Posso atender de graça?": _make_answer(
-        "Sim, mas com ética (não promocional).",
-        [
-            "O atendimento voluntário é permitido e nobre.",
-            "Não pode ser usado para captar clientela (ex: '1ª sessão grátis' como marketing).",
-            "Deve ser um trabalho social genuíno ou vinculado a instituição."
-        ]
-    ),
-    "Posso divulgar o valor da sessão no Instagram?": _make_answer(
-        "Não. Evite propaganda por preço.",
-        [
-            "O preço não deve ser o diferencial competitivo.",
-            "Informe o valor apenas quando o interessado entrar em contato (direct/whatsapp).",
-            "Se houver dúvidas específicas, consulte orientações do CRP/CFP e pratique comunicação responsável."
-        ]
-    ),
-    "Como lidar com inadimplência?": _make_answer(
-        "Sem exposição e com diálogo.",
-        [
-            "O psicólogo não pode expor o paciente a situações vexatórias de cobrança.",
-            "Tente renegociar, parcelar ou entender o motivo.",
-            "Se a inadimplência persistir, pode-se suspender o atendimento, com encaminhamento e encerramento ético."
-        ]
-    ),
-
-    # --- TEMAS SENSÍVEIS / RELIGIÃO / SEXUALIDADE ---
-    "Existe cura gay?": _make_answer(
-        "Não. E é proibido oferecer.",
-        [
-            "A homossexualidade não é doença, perversão ou distúrbio.",
-            "É vedado colaborar com serviços que proponham 'tratamento' ou 'cura' da homossexualidade.",
-            "O foco ético é acolher sofrimento, principalmente o decorrente do preconceito."
-        ]
-    ),
-    "Posso orar com o paciente na sessão?": _make_answer(
-        "Evite misturar técnica com prática religiosa.",
-        [
-            "A psicologia é laica.",
-            "O psicólogo deve respeitar a crença do paciente, mas não deve induzir práticas religiosas durante o atendimento técnico.",
-            "Se espiritualidade for tema do paciente, pode ser acolhida como conteúdo, sem ritualização."
-        ]
-    ),
-    "Posso recusar atendimento por conflito de valores?": _make_answer(
-        "Sim. É ético reconhecer limites.",
-        [
-            "Se uma demanda impedir uma escuta responsável, recusar pode ser o mais ético.",
-            "Justifique de forma respeitosa e encaminhe para outro profissional qualificado.",
-            "Evite moralização ou tentativa de 'corrigir' o paciente."
-        ]
-    ),
-
-    # --- ENCERRAMENTO E ENCAMINHAMENTO ---
-    "Como encerrar terapia de forma ética?": _make_answer(
-        "Planejamento e Autonomia.",
-        [
-            "O encerramento (alta) deve ser trabalhado processualmente, não abruptamente.",
-            "Deve visar a autonomia do paciente.",
-            "Se for interrupção (pelo terapeuta), oferecer encaminhamento e apoiar continuidade do cuidado."
-        ]
-    ),
-    "Quando devo encaminhar um paciente?": _make_answer(
-        "Limites técnicos ou pessoais.",
-        [
-            "Quando a demanda exige competência técnica que você não possui.",
-            "Quando há quebra do vínculo de confiança ou conflito de valores intransponível.",
-            "Faça o encaminhamento de forma responsável, indicando serviços adequados."
-        ]
-    ),
-    "Posso atender adolescente sem os pais saberem?": _make_answer(
-        "Depende da situação e do contrato.",
-        [
-            "Adolescente tem direito a escuta e sigilo em muitos contextos.",
-            "Para continuidade e responsabilidade legal/financeira, responsáveis normalmente precisam estar cientes.",
-            "Em suspeita de violência intrafamiliar, priorize proteção e acione rede (Conselho Tutelar), seguindo o mínimo necessário."
-        ]
-    ),
-    "Como agir em suspeita de violência (rede de proteção)?": _make_answer(
-        "Notificação e Proteção.",
-        [
-            "Em casos de violência contra criança, adolescente, idoso ou mulher, pode haver dever de notificação conforme legislação aplicável.",
-            "Não confronte o suposto agressor se isso colocar a vítima em risco.",
-            "Acione a rede de proteção (CREAS, Conselho Tutelar, Delegacia) de forma articulada."
-        ]
-    ),
-}
+# BANCO DE DADOS DE RESPOSTAS (data/respostas.json)
+# =====================================================
+# O conteúdo fica em JSON (título, itens, delicada) e é compilado uma vez para
+# HTML pronto e já escapado, em um mapeamento somente leitura. Editar o arquivo
+# troca a tabela inteira no próximo acesso, sem reiniciar o servidor.
+ANSWERS_PATH = os.environ.get(
+    "ANSWERS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "respostas.json"))
+ANSWERS_CHECK_SECONDS = float(os.environ.get("ANSWERS_CHECK_SECONDS", "2"))
+
+def _compile_answer(item: dict) -> str:
+    return _make_answer(item["titulo"], item["itens"], item.get("delicada", True))
+
+def compile_answers(path: str = ANSWERS_PATH) -> tuple[MappingProxyType, str]:
+    """Lê o JSON e devolve (pergunta -> HTML, HTML do fallback)."""
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    table = {q: _compile_answer(item) for q, item in raw["respostas"].items()}
+    return MappingProxyType(table), _compile_answer(raw["fallback"])
+
+# Preenchidos por reload_answers() logo após a definição do QuestionMatcher.
+RESPOSTAS_DB: MappingProxyType = MappingProxyType({})
+_FALLBACK_ANSWER = ""
+_answers_state = {"mtime": None, "checked": 0.0}
+_answers_lock = threading.Lock()
 
 # =====================================================
 # GERAÇÃO DE RESPOSTAS
 # =====================================================
+def _normalize_question(s: str) -> str:
+    """Minúsculas, sem acentos e sem pontuação: "Está?" -> "esta"."""
+    s = unicodedata.normalize("NFKD", s or "")
+    s = "".join(ch for ch in s if not unicodedata.combining(ch)).lower()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", s).split())
+
+class QuestionMatcher:
+    """Acha a pergunta canônica mais parecida com um texto digitado.
+
+    Primeiro tenta a forma normalizada exata; depois compara trigramas de
+    caracteres (coeficiente de Dice) usando um índice invertido, de modo que só
+    as perguntas que compartilham algum trigrama são pontuadas.
+    """
+
+    def __init__(self, questions, threshold: float = 0.7):
+        self.threshold = threshold
+        self.questions = list(dict.fromkeys(questions))
+        self._exact = {}
+        self._sizes = []
+        self._index = defaultdict(list)  # trigrama -> [índice da pergunta]
+        for i, q in enumerate(self.questions):
+            norm = _normalize_question(q)
+            self._exact.setdefault(norm, q)
+            grams = self._ngrams(norm)
+            self._sizes.append(len(grams))
+            for g in grams:
+                self._index[g].append(i)
+
+    @staticmethod
+    def _ngrams(norm: str) -> set:
+        padded = f"  {norm} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def match(self, text: str) -> tuple[str | None, float]:
+        norm = _normalize_question(text)
+        if not norm:
+            return None, 0.0
+        if norm in self._exact:
+            return self._exact[norm], 1.0
+
+        grams = self._ngrams(norm)
+        shared = defaultdict(int)
+        for g in grams:
+            for i in self._index.get(g, ()):
+                shared[i] += 1
+        best, best_score = None, 0.0
+        for i, n in shared.items():
+            score = 2.0 * n / (len(grams) + self._sizes[i])
+            if score > best_score:
+                best, best_score = i, score
+        best_score = round(best_score, 3)
+        if best is None or best_score < self.threshold:
+            return None, best_score
+        return self.questions[best], best_score
+
+def reload_answers(force: bool = False) -> bool:
+    """Recompila as respostas (e o matcher) se o arquivo mudou. True se trocou."""
+    global RESPOSTAS_DB, _FALLBACK_ANSWER, _matcher
+    with _answers_lock:
+        mtime = os.stat(ANSWERS_PATH).st_mtime_ns
+        if not force and mtime == _answers_state["mtime"]:
+            return False
+        # Marca antes de compilar: um JSON inválido é registrado uma vez, não a cada acesso.
+        _answers_state["mtime"] = mtime
+        table, fallback = compile_answers(ANSWERS_PATH)
+        matcher = QuestionMatcher(list(QUICK_QUESTIONS) + list(table))
+        # Troca por atribuição: leitores concorrentes veem a tabela antiga ou a nova, nunca uma mistura.
+        RESPOSTAS_DB, _FALLBACK_ANSWER, _matcher = table, fallback, matcher
+        return True
+
+def _maybe_reload_answers() -> None:
+    """Confere o mtime no máximo a cada ANSWERS_CHECK_SECONDS; JSON inválido mantém a versão atual."""
+    now = time.monotonic()
+    if now - _answers_state["checked"] < ANSWERS_CHECK_SECONDS:
+        return
+    _answers_state["checked"] = now
+    try:
+        if reload_answers():
+            app.logger.info("respostas recarregadas de %s", ANSWERS_PATH)
+    except (OSError, ValueError, KeyError, TypeError):
+        app.logger.exception("falha ao recarregar %s; mantendo a versão anterior", ANSWERS_PATH)
+
+reload_answers(force=True)
+
+def match_question(q: str) -> tuple[str | None, float]:
+    """(pergunta canônica, score 0..1) ou (None, melhor score) abaixo do limiar."""
+    _maybe_reload_answers()
+    return _matcher.match(q)
+
+@timed("answer")
+def answer_question(q: str) -> tuple[str, str | None, float]:
+    """(html da resposta, pergunta canônica, score) com um único match."""
+    _maybe_reload_answers()
+    answers = RESPOSTAS_DB
+    if q in answers:
+        return answers[q], q, 1.0
+    key, score = _matcher.match(q)
+    if key in answers:
+        return answers[key], key, score
+    return _FALLBACK_ANSWER, key, score
+
 def generate_answer_for_question(q: str) -> str:
     """Retorna a resposta específica do DB ou um fallback genérico."""
-    if q in RESPOSTAS_DB:
-        return RESPOSTAS_DB[q]
-
-    return _make_answer(
-        "Consulte o Código de Ética",
-        [
-            "Esta pergunta requer análise específica dos artigos e resoluções aplicáveis.",
-            "Recomenda-se leitura da normativa pertinente ao tema (ex: documentos, online, registro).",
-            "Na dúvida, consulte a COF do seu CRP e leve para supervisão."
-        ],
-        delicate=True
-    )
+    return answer_question(q)[0]
 
 # =====================================================
 # BANCO DE DADOS (SQLITE)
 # =====================================================
-def db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+# Uma conexão por thread (por worker, no gunicorn sync), reaproveitada entre
+# requests. Escritas passam por transaction(), que usa BEGIN IMMEDIATE e
+# contabiliza quanto tempo esperamos pelo lock de escrita.
+DB_WAIT_THRESHOLD_MS = 5
+
+_db_local = threading.local()
+_db_stats_lock = threading.Lock()
+_db_stats = {"opened": 0, "open": 0, "waits": 0, "wait_ms": 0.0, "busy_errors": 0}
+
+def _db_stat_add(key: str, value=1):
+    with _db_stats_lock:
+        _db_stats[key] += value
+
+class _PooledConnection(sqlite3.Connection):
+    """Conexão que mantém o contador de conexões abertas em dia e mede as consultas do request."""
+
+    def execute(self, *args):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _record_sql(time.perf_counter() - t0)
+
+    def executemany(self, *args):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _record_sql(time.perf_counter() - t0)
+
+    def close(self):
+        super().close()
+        fin = getattr(self, "_finalizer", None)
+        if fin is not None:
+            fin()
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000.0,
+        isolation_level=None,  # transações explícitas via transaction()
+        check_same_thread=False,
+        factory=_PooledConnection,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_BYTES}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn._finalizer = weakref.finalize(conn, _db_stat_add, "open", -1)
+    _db_stat_add("opened")
+    _db_stat_add("open")
     return conn
 
-def init_db():
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("""CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, title TEXT, created_at TEXT)""")
-    cur.execute("""CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, doc_id INTEGER, chunk_text TEXT)""")
-    cur.execute("""CREATE TABLE IF NOT EXISTS qa_history (id INTEGER PRIMARY KEY, question TEXT, answer TEXT, created_at TEXT)""")
-    conn.commit()
-    conn.close()
+def db() -> sqlite3.Connection:
+    """Conexão da thread atual. Não feche: ela é reaproveitada."""
+    conn = getattr(_db_local, "conn", None)
+    # Depois de um fork (gunicorn), a conexão herdada do processo pai não serve.
+    if conn is None or getattr(_db_local, "pid", None) != os.getpid():
+        conn = _connect()
+        _db_local.conn = conn
+        _db_local.pid = os.getpid()
+    return conn
 
-def clear_documents():
+def close_db():
+    """Fecha a conexão da thread atual (ex.: ao encerrar uma thread de fundo)."""
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None and getattr(_db_local, "pid", None) == os.getpid():
+        conn.close()
+    _db_local.conn = None
+
+@contextmanager
+def transaction():
+    """Transação de escrita: BEGIN IMMEDIATE ... COMMIT (ROLLBACK em erro)."""
     conn = db()
-    conn.execute("DELETE FROM chunks")
-    conn.execute("DELETE FROM documents")
-    conn.commit()
-    conn.close()
+    t0 = time.perf_counter()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError:
+        _db_stat_add("busy_errors")
+        raise
+    waited_ms = (time.perf_counter() - t0) * 1000.0
+    if waited_ms >= DB_WAIT_THRESHOLD_MS:
+        with _db_stats_lock:
+            _db_stats["waits"] += 1
+            _db_stats["wait_ms"] += waited_ms
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def db_stats() -> dict:
+    with _db_stats_lock:
+        out = dict(_db_stats)
+    out["wait_ms"] = round(out["wait_ms"], 1)
+    out["pid"] = os.getpid()
+    return out
+
+@app.teardown_appcontext
+def _rollback_dangling_tx(exc):
+    # Se algo falhou no meio de uma transação, não deixa o lock preso na conexão reaproveitada.
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None and getattr(_db_local, "pid", None) == os.getpid() and conn.in_transaction:
+        conn.execute("ROLLBACK")
 
-def save_history(question: str, answer: str):
+def init_db():
     conn = db()
+    conn.execute("""CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, title TEXT, created_at TEXT)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, doc_id INTEGER, chunk_text TEXT)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS qa_history (id INTEGER PRIMARY KEY, question TEXT, answer TEXT, created_at TEXT)""")
+    _init_fts(conn)
+    _migrate(conn)
+
+# =====================================================
+# MIGRAÇÕES (PRAGMA user_version)
+# =====================================================
+# Cada função leva o schema da versão N-1 para N e roda dentro de uma transação.
+# Um banco novo passa pelo mesmo caminho de um banco antigo.
+def _answer_hash(html: str) -> str:
+    return hashlib.sha256((html or "").encode("utf-8")).hexdigest()
+
+def _migrate_1_answers(conn: sqlite3.Connection):
+    """Respostas passam a ser gravadas uma vez só, em answers, referenciadas por id."""
+    conn.create_function("answer_hash", 1, _answer_hash, deterministic=True)
+    conn.execute("""CREATE TABLE answers (id INTEGER PRIMARY KEY, hash TEXT NOT NULL UNIQUE, html TEXT NOT NULL)""")
+    conn.execute("""INSERT OR IGNORE INTO answers (hash, html)
+                    SELECT answer_hash(answer), answer FROM qa_history WHERE answer IS NOT NULL""")
+    conn.execute("""CREATE TABLE qa_history_new (
+                        id INTEGER PRIMARY KEY, question TEXT,
+                        answer_id INTEGER REFERENCES answers(id), created_at TEXT)""")
+    conn.execute("""INSERT INTO qa_history_new (id, question, answer_id, created_at)
+                    SELECT h.id, h.question, a.id, h.created_at
+                    FROM qa_history h LEFT JOIN answers a ON a.hash = answer_hash(h.answer)""")
+    conn.execute("DROP TABLE qa_history")
+    conn.execute("ALTER TABLE qa_history_new RENAME TO qa_history")
+
+def _legacy_to_iso(value):
+    """'30/01 20:01' (sem ano) -> '2026-01-30T20:01:00'. Assume o ano corrente,
+    ou o anterior se a data cairia no futuro."""
+    try:
+        dt = datetime.strptime(value, "%d/%m %H:%M")
+    except (TypeError, ValueError):
+        return value
+    now = datetime.now()
+    dt = dt.replace(year=now.year)
+    if dt > now:
+        dt = dt.replace(year=now.year - 1)
+    return dt.isoformat(timespec="seconds")
+
+def _migrate_2_iso_timestamps(conn: sqlite3.Connection):
+    """created_at passa a ser ISO 8601 (ordenável), com índice."""
+    conn.create_function("legacy_to_iso", 1, _legacy_to_iso, deterministic=True)
+    conn.execute("UPDATE qa_history SET created_at = legacy_to_iso(created_at) WHERE created_at LIKE '__/__ __:__'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_qa_history_created_at ON qa_history (created_at)")
+
+_COUNTED_TABLES = ("documents", "chunks", "qa_history")
+
+def _migrate_3_counters(conn: sqlite3.Connection):
+    """Contagens mantidas por triggers: stats() vira um SELECT de 3 linhas."""
+    conn.execute("CREATE TABLE counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    for table in _COUNTED_TABLES:
+        conn.execute(f"INSERT INTO counters (name, value) SELECT '{table}', COUNT(*) FROM {table}")
+        conn.execute(f"""CREATE TRIGGER {table}_count_ai AFTER INSERT ON {table} BEGIN
+                             UPDATE counters SET value = value + 1 WHERE name = '{table}';
+                         END""")
+        conn.execute(f"""CREATE TRIGGER {table}_count_ad AFTER DELETE ON {table} BEGIN
+                             UPDATE counters SET value = value - 1 WHERE name = '{table}';
+                         END""")
+
+def _migrate_4_chunks_removed(conn: sqlite3.Connection):
+    """Contador monotônico de chunks apagados (ids são reaproveitados pelo SQLite)."""
+    conn.execute("INSERT INTO counters (name, value) VALUES ('chunks_removed', 0)")
+    conn.execute("""CREATE TRIGGER chunks_removed_ad AFTER DELETE ON chunks BEGIN
+                        UPDATE counters SET value = value + 1 WHERE name = 'chunks_removed';
+                    END""")
+
+def _migrate_5_generations(conn: sqlite3.Connection):
+    """Corpus versionado por geração: a reindexação monta a próxima geração ao
+    lado da ativa e troca as duas num único UPDATE (ver start_reindex)."""
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value)")
+    conn.execute("INSERT INTO meta (key, value) VALUES ('active_generation', 0)")
+    for table in ("documents", "chunks"):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN generation INTEGER NOT NULL DEFAULT 0")
+        conn.execute(f"CREATE INDEX idx_{table}_generation ON {table} (generation)")
+        # Só a geração ativa entra nas contagens de stats().
+        conn.execute(f"DROP TRIGGER {table}_count_ai")
+        conn.execute(f"DROP TRIGGER {table}_count_ad")
+        conn.execute(f"""CREATE TRIGGER {table}_count_ai AFTER INSERT ON {table}
+                         WHEN NEW.generation = (SELECT value FROM meta WHERE key = 'active_generation') BEGIN
+                             UPDATE counters SET value = value + 1 WHERE name = '{table}';
+                         END""")
+        conn.execute(f"""CREATE TRIGGER {table}_count_ad AFTER DELETE ON {table}
+                         WHEN OLD.generation = (SELECT value FROM meta WHERE key = 'active_generation') BEGIN
+                             UPDATE counters SET value = value - 1 WHERE name = '{table}';
+                         END""")
+
+def _chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+def _migrate_6_content_hashes(conn: sqlite3.Connection):
+    """Hash por documento e por chunk; chunks repetidos no mesmo documento somem."""
+    conn.create_function("chunk_hash", 1, _chunk_hash, deterministic=True)
+    conn.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+    conn.execute("ALTER TABLE chunks ADD COLUMN chunk_hash TEXT")
+    conn.execute("UPDATE chunks SET chunk_hash = chunk_hash(chunk_text)")
+    conn.execute("DELETE FROM chunks WHERE id NOT IN (SELECT MIN(id) FROM chunks GROUP BY doc_id, chunk_hash)")
+    conn.execute("CREATE UNIQUE INDEX idx_chunks_doc_hash ON chunks (doc_id, chunk_hash)")
+    conn.execute("CREATE INDEX idx_documents_title ON documents (generation, title)")
+
+def _migrate_7_question_daily(conn: sqlite3.Connection):
+    """Contagem por dia e por pergunta normalizada, mantida a cada gravação do histórico.
+
+    Fica fora dos triggers porque a normalização (acentos, pontuação) é feita
+    em Python. monthly=1 marca buckets já consolidados por mês (day = dia 1).
+    """
+    conn.create_function("normalize_question", 1, _normalize_question, deterministic=True)
     conn.execute(
-        "INSERT INTO qa_history (question, answer, created_at) VALUES (?,?,?)",
-        (question, answer, datetime.now().strftime("%d/%m %H:%M"))
+        """CREATE TABLE question_daily (
+               day TEXT NOT NULL,
+               qkey TEXT NOT NULL,
+               question TEXT NOT NULL,
+               n INTEGER NOT NULL,
+               monthly INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (day, qkey)
+           ) WITHOUT ROWID"""
+    )
+    conn.execute(
+        """INSERT INTO question_daily (day, qkey, question, n)
+           SELECT substr(created_at, 1, 10), normalize_question(question), MIN(question), COUNT(*)
+           FROM qa_history
+           WHERE normalize_question(question) != ''
+           GROUP BY 1, 2"""
+    )
+
+_MIGRATIONS = [
+    _migrate_1_answers,
+    _migrate_2_iso_timestamps,
+    _migrate_3_counters,
+    _migrate_4_chunks_removed,
+    _migrate_5_generations,
+    _migrate_6_content_hashes,
+    _migrate_7_question_daily,
+]
+
+def _migrate(conn: sqlite3.Connection):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(_MIGRATIONS):
+        return
+    for n, step in enumerate(_MIGRATIONS[version:], start=version + 1):
+        with transaction():
+            # Outro worker pode ter migrado enquanto esperávamos o lock.
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= n:
+                continue
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {n}")
+        app.logger.info("Banco migrado para a versão %d", n)
+    # Devolve ao disco as páginas liberadas pelas migrações. auto_vacuum só
+    # muda de modo com VACUUM; INCREMENTAL permite à retenção liberar espaço aos poucos.
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+# Índice FTS5 sobre chunks (conteúdo externo, sincronizado por triggers).
+# remove_diacritics faz "sigilo"/"SIGILO" e "psicólogo"/"psicologo" casarem.
+_FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+        chunk_text, content='chunks', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS chunks_fts_ai AFTER INSERT ON chunks BEGIN
+        INSERT INTO chunks_fts(rowid, chunk_text) VALUES (new.id, new.chunk_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chunks_fts_ad AFTER DELETE ON chunks BEGIN
+        INSERT INTO chunks_fts(chunks_fts, rowid, chunk_text) VALUES ('delete', old.id, old.chunk_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chunks_fts_au AFTER UPDATE ON chunks BEGIN
+        INSERT INTO chunks_fts(chunks_fts, rowid, chunk_text) VALUES ('delete', old.id, old.chunk_text);
+        INSERT INTO chunks_fts(rowid, chunk_text) VALUES (new.id, new.chunk_text);
+    END""",
+]
+
+_fts_state = {"enabled": None}
+
+def _init_fts(conn: sqlite3.Connection):
+    existed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+    try:
+        with transaction():
+            for sql in _FTS_SCHEMA:
+                conn.execute(sql)
+            if not existed:
+                # Indexa o que já estava em chunks antes do FTS existir.
+                conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+    except sqlite3.OperationalError as e:
+        if "fts5" not in str(e):
+            raise
+        app.logger.warning("SQLite sem FTS5; busca vai usar LIKE.")
+    _fts_state["enabled"] = None
+
+def _fts_enabled() -> bool:
+    if _fts_state["enabled"] is None:
+        row = db().execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+        _fts_state["enabled"] = row is not None
+    return _fts_state["enabled"]
+
+def clear_documents():
+    with transaction() as conn:
+        conn.execute("DELETE FROM chunks")
+        conn.execute("DELETE FROM documents")
+
+# hash -> answers.id; respostas nunca mudam de id, então o cache vale pelo processo todo.
+_answer_ids = {}
+
+def _write_history_rows(rows: list[tuple]):
+    """Grava (question, answer_html, created_at) em uma única transação.
+
+    O HTML vai para answers (uma linha por conteúdo distinto); qa_history só
+    guarda o id.
+    """
+    hashes = [_answer_hash(a) for (_, a, _) in rows]
+    new_ids = {}
+    with transaction() as conn:
+        for h, (_, html, _) in zip(hashes, rows):
+            if h in _answer_ids or h in new_ids:
+                continue
+            conn.execute("INSERT OR IGNORE INTO answers (hash, html) VALUES (?,?)", (h, html or ""))
+            new_ids[h] = conn.execute("SELECT id FROM answers WHERE hash = ?", (h,)).fetchone()[0]
+        ids = {**_answer_ids, **new_ids}
+        conn.executemany(
+            "INSERT INTO qa_history (question, answer_id, created_at) VALUES (?,?,?)",
+            [(q, ids[h], t) for h, (q, _, t) in zip(hashes, rows)],
+        )
+        _bump_question_daily(conn, rows)
+    # Só entra no cache depois do COMMIT.
+    _answer_ids.update(new_ids)
+
+def _bump_question_daily(conn: sqlite3.Connection, rows: list[tuple]):
+    """Soma o lote em question_daily (mesma transação do INSERT no histórico)."""
+    buckets = {}
+    for q, _, t in rows:
+        qkey = _normalize_question(q)
+        if not qkey:
+            continue
+        key = ((t or "")[:10], qkey)
+        n, text = buckets.get(key, (0, q))
+        buckets[key] = (n + 1, text)
+    conn.executemany(
+        """INSERT INTO question_daily (day, qkey, question, n) VALUES (?,?,?,?)
+           ON CONFLICT (day, qkey) DO UPDATE SET n = n + excluded.n""",
+        [(day, qkey, text, n) for (day, qkey), (n, text) in buckets.items()],
     )
-    conn.commit()
-    conn.close()
 
+class _HistoryWriter:
+    """Fila limitada + thread que grava qa_history em lotes.
+
+    O lote é gravado quando chega a HISTORY_BATCH_MAX linhas ou quando passam
+    HISTORY_FLUSH_SECONDS desde a primeira linha do lote. Com a fila cheia a
+    linha é descartada (e contada em "dropped") para não travar o request.
+    """
+
+    _STOP = object()
+
+    def __init__(self, maxsize: int, batch_max: int, flush_seconds: float):
+        self.batch_max = batch_max
+        self.flush_seconds = flush_seconds
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._pending = []  # linhas aceitas e ainda não gravadas, em ordem
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self.counters = {"enqueued": 0, "written": 0, "dropped": 0, "batches": 0,
+                         "last_batch": 0, "max_batch": 0, "errors": 0}
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Processo filho (fork): fila e pendências eram do pai.
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+                self._pending = []
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, row: tuple) -> bool:
+        if self._stopping:
+            _write_history_rows([row])
+            return True
+        self._ensure_thread()
+        with self._lock:
+            try:
+                self.queue.put_nowait(row)
+            except queue.Full:
+                self.counters["dropped"] += 1
+                return False
+            self._pending.append(row)
+            self.counters["enqueued"] += 1
+        return True
+
+    def pending_rows(self) -> list[tuple]:
+        with self._lock:
+            return list(self._pending)
+
+    def _flush(self, batch: list[tuple]):
+        try:
+            _write_history_rows(batch)
+        except Exception:
+            app.logger.exception("Falha ao gravar lote de histórico (%d linhas)", len(batch))
+            ok = False
+        else:
+            ok = True
+        with self._lock:
+            del self._pending[:len(batch)]
+            c = self.counters
+            if ok:
+                c["written"] += len(batch)
+                c["batches"] += 1
+                c["last_batch"] = len(batch)
+                c["max_batch"] = max(c["max_batch"], len(batch))
+            else:
+                c["errors"] += 1
+                c["dropped"] += len(batch)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            if item is self._STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_max:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+        # Drena o que ainda estiver na fila antes de sair.
+        rest = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                rest.append(item)
+        for i in range(0, len(rest), self.batch_max):
+            self._flush(rest[i:i + self.batch_max])
+        close_db()
+
+    def stop(self, timeout: float = 10.0):
+        """Grava tudo o que está na fila e encerra a thread (atexit / worker_exit)."""
+        self._stopping = True
+        t = self._thread
+        if t is None or self._pid != os.getpid() or not t.is_alive():
+            return
+        self.queue.put(self._STOP)
+        t.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self.counters)
+        out["queue_depth"] = self.queue.qsize()
+        out["queue_max"] = self.queue.maxsize
+        out["enabled"] = bool(app.config["HISTORY_WRITE_BEHIND"])
+        return out
+
+_history_writer = _HistoryWriter(HISTORY_QUEUE_MAX, HISTORY_BATCH_MAX, HISTORY_FLUSH_SECONDS)
+atexit.register(_history_writer.stop)
+
+@timed("history_write")
+def save_history(question: str, answer: str):
+    row = (question, answer, datetime.now().isoformat(timespec="seconds"))
+    if app.config["HISTORY_WRITE_BEHIND"]:
+        _history_writer.submit(row)
+    else:
+        _write_history_rows([row])
+
+def history_writer_stats() -> dict:
+    return _history_writer.stats()
+
+def _history_item(id_, question, answer, created_iso) -> dict:
+    # created_at continua no formato curto que o home.html sempre exibiu.
+    try:
+        shown = datetime.fromisoformat(created_iso).strftime("%d/%m %H:%M")
+    except (TypeError, ValueError):
+        shown = created_iso
+    return {"id": id_, "question": question, "answer": answer, "created_at": shown, "created_iso": created_iso}
+
+def _pending_history() -> list[dict]:
+    """Linhas ainda na fila do write-behind, mais recentes primeiro."""
+    return [_history_item(None, q, a, t) for (q, a, t) in reversed(_history_writer.pending_rows())]
+
+@timed("history_read")
 def get_history(limit: int = 50):
-    conn = db()
-    rows = conn.execute("SELECT * FROM qa_history ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    rows = db().execute(
+        """SELECT h.id, h.question, a.html AS answer, h.created_at
+           FROM qa_history h LEFT JOIN answers a ON a.id = h.answer_id
+           ORDER BY h.id DESC LIMIT ?""",
+        (limit,),
+    ).fetchall()
+    return (_pending_history() + [_history_item(*r) for r in rows])[:limit]
+
+@timed("history_read")
+def get_history_page(before_id: int | None = None, limit: int = 20, with_answers: bool = False) -> dict:
+    """Página do histórico por cursor (id), do mais novo para o mais antigo.
+
+    Retorna {"items": [...], "next_cursor": id ou None}. Sem with_answers, o HTML
+    das respostas não é lido.
+    """
+    answer_col = "a.html" if with_answers else "NULL"
+    sql = f"""SELECT h.id, h.question, {answer_col} AS answer, h.created_at
+              FROM qa_history h LEFT JOIN answers a ON a.id = h.answer_id"""
+    params = []
+    if before_id is not None:
+        sql += " WHERE h.id < ?"
+        params.append(before_id)
+    sql += " ORDER BY h.id DESC LIMIT ?"
+    params.append(limit + 1)
+    rows = db().execute(sql, params).fetchall()
+
+    items = [_history_item(*r) for r in rows[:limit]]
+    if before_id is None:
+        pending = _pending_history()
+        if not with_answers:
+            for p in pending:
+                p["answer"] = None
+        items = pending + items
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+def _connect_readonly() -> sqlite3.Connection:
+    """Conexão só de leitura (mode=ro): não consegue pegar lock de escrita."""
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, timeout=DB_BUSY_TIMEOUT_MS / 1000.0,
+                           check_same_thread=False)
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    return conn
 
-def stats():
+def iter_history_export(fmt: str = "csv", desde: str | None = None, ate: str | None = None,
+                        with_answers: bool = False):
+    """Gera o histórico inteiro (ou o período [desde, ate]) em CSV ou NDJSON, lote a lote.
+
+    Lê por uma conexão própria, somente leitura: no WAL a leitura vê um retrato
+    do banco e não bloqueia o save_history. Percorre o índice de created_at
+    (sem ordenação em memória), com fetchmany de HISTORY_EXPORT_BATCH linhas.
+    """
+    cols = ["id", "created_at", "question"] + (["answer_html"] if with_answers else [])
+    sql = "SELECT h.id, h.created_at, h.question" + (", a.html" if with_answers else "")
+    sql += """ FROM qa_history h LEFT JOIN answers a ON a.id = h.answer_id
+               WHERE h.created_at >= ? AND h.created_at < ?
+               ORDER BY h.created_at, h.id"""
+    # `ate` é inclusivo: vai até o fim do dia.
+    params = (desde or "", (ate + "T99") if ate else "9999")
+
+    conn = _connect_readonly()
+    try:
+        cur = conn.execute(sql, params)
+        buf = StringIO()
+        writer = csv.writer(buf)
+        if fmt == "csv":
+            writer.writerow(cols)
+            yield "\ufeff" + buf.getvalue()  # BOM: o Excel abre os acentos certos
+        while True:
+            rows = cur.fetchmany(HISTORY_EXPORT_BATCH)
+            if not rows:
+                break
+            buf.seek(0)
+            buf.truncate()
+            if fmt == "csv":
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buf.write(json.dumps(dict(zip(cols, row)), ensure_ascii=False) + "\n")
+            yield buf.getvalue()
+    finally:
+        conn.close()
+
+def run_history_retention(days: int | None = None, mode: str | None = None,
+                          batch_size: int | None = None) -> dict:
+    """Apaga (ou arquiva) o histórico mais antigo que `days`, em lotes curtos.
+
+    Cada lote é uma transação própria, então o write-behind nunca espera muito
+    pelo lock. No fim, PRAGMA incremental_vacuum devolve as páginas livres.
+    """
+    days = HISTORY_RETENTION_DAYS if days is None else days
+    mode = mode or HISTORY_RETENTION_MODE
+    batch_size = batch_size or HISTORY_RETENTION_BATCH
+    if days <= 0:
+        return {"removed": 0, "archived": 0, "freed_pages": 0}
+
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat(timespec="seconds")
     conn = db()
+    archive = mode == "archive"
+    if archive:
+        attached = {r[1] for r in conn.execute("PRAGMA database_list")}
+        if "archive" not in attached:
+            conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+        conn.execute("""CREATE TABLE IF NOT EXISTS archive.qa_history
+                        (id INTEGER PRIMARY KEY, question TEXT, answer TEXT, created_at TEXT)""")
+
+    removed = 0
+    while True:
+        with transaction():
+            ids = [r[0] for r in conn.execute(
+                "SELECT id FROM qa_history WHERE created_at < ? ORDER BY created_at LIMIT ?",
+                (cutoff, batch_size),
+            )]
+            if not ids:
+                break
+            marks = ",".join("?" * len(ids))
+            if archive:
+                conn.execute(
+                    f"""INSERT OR IGNORE INTO archive.qa_history (id, question, answer, created_at)
+                        SELECT h.id, h.question, a.html, h.created_at
+                        FROM qa_history h LEFT JOIN answers a ON a.id = h.answer_id
+                        WHERE h.id IN ({marks})""",
+                    ids,
+                )
+            conn.execute(f"DELETE FROM qa_history WHERE id IN ({marks})", ids)
+        removed += len(ids)
+        time.sleep(0)  # deixa outras threads pegarem o lock entre lotes
+
+    freed = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.execute("PRAGMA incremental_vacuum").fetchall()
+    if archive:
+        conn.execute("DETACH DATABASE archive")
+    return {"removed": removed, "archived": removed if archive else 0, "freed_pages": freed}
+
+# -----------------------------------------------------
+# Perguntas mais feitas (lê só question_daily, nunca agrupa qa_history)
+# -----------------------------------------------------
+# A retenção apaga qa_history mas não mexe no agregado: as tendências continuam
+# disponíveis depois que as perguntas em si foram removidas.
+def top_questions(start: str | None = None, end: str | None = None, limit: int = 10) -> list[dict]:
+    """Mais perguntadas entre start e end (YYYY-MM-DD, inclusivos; None = sem limite)."""
+    canonical = {_normalize_question(q): q for q in list(QUICK_QUESTIONS) + list(RESPOSTAS_DB)}
+    rows = db().execute(
+        """SELECT qkey, MIN(question), SUM(n) AS total FROM question_daily
+           WHERE day >= ? AND day <= ?
+           GROUP BY qkey ORDER BY total DESC, qkey LIMIT ?""",
+        (start or "", end or "9999-12-31", limit),
+    ).fetchall()
+    return [{"question": canonical.get(qkey, text), "count": total, "answered": qkey in canonical}
+            for qkey, text, total in rows]
+
+def question_trend(start: str | None = None, end: str | None = None) -> list[dict]:
+    """Total de perguntas por bucket (dia, ou mês para o período já consolidado)."""
+    rows = db().execute(
+        """SELECT day, MAX(monthly), SUM(n) FROM question_daily
+           WHERE day >= ? AND day <= ? GROUP BY day ORDER BY day""",
+        (start or "", end or "9999-12-31"),
+    ).fetchall()
+    return [{"day": day, "monthly": bool(monthly), "count": total} for day, monthly, total in rows]
+
+def rollup_question_stats(keep_days: int = QUESTION_STATS_DAILY_DAYS) -> dict:
+    """Consolida em um bucket por mês os dias de meses inteiros mais antigos que keep_days."""
+    cutoff = (datetime.now() - timedelta(days=keep_days)).strftime("%Y-%m-01")
+    with transaction() as conn:
+        before = conn.execute("SELECT COUNT(*) FROM question_daily").fetchone()[0]
+        # O dia 1 entra na soma e vira o próprio bucket mensal (mesma chave).
+        conn.execute(
+            """INSERT INTO question_daily (day, qkey, question, n, monthly)
+               SELECT substr(day, 1, 7) || '-01', qkey, MIN(question), SUM(n), 1
+               FROM question_daily
+               WHERE monthly = 0 AND day < ?
+               GROUP BY 1, qkey
+               ON CONFLICT (day, qkey) DO UPDATE SET
+                   n = CASE WHEN monthly THEN n + excluded.n ELSE excluded.n END,
+                   monthly = 1""",
+            (cutoff,),
+        )
+        conn.execute("DELETE FROM question_daily WHERE monthly = 0 AND day < ?", (cutoff,))
+        after = conn.execute("SELECT COUNT(*) FROM question_daily").fetchone()[0]
+    return {"cutoff": cutoff, "rows_before": before, "rows_after": after}
+
+@timed("stats")
+def stats():
+    # Lê os contadores mantidos por trigger (ver _migrate_3_counters): O(1) e
+    # consistente entre workers, já que vive no próprio banco.
     try:
-        d = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
-        c = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
-        h = conn.execute("SELECT COUNT(*) FROM qa_history").fetchone()[0]
+        rows = dict(db().execute("SELECT name, value FROM counters").fetchall())
     except Exception:
-        conn.close()
         return {"documents": 0, "chunks": 0, "history": 0}
-    conn.close()
-    return {"documents": d, "chunks": c, "history": h}
+    return {
+        "documents": rows.get("documents", 0),
+        "chunks": rows.get("chunks", 0),
+        "history": rows.get("qa_history", 0),
+    }
+
+# =====================================================
+# AUTOCOMPLETE (TRIE DE PREFIXOS)
+# =====================================================
+# Cada frase entra na trie (sem acentos) a partir do início e de cada palavra,
+# então "sigilo" também acha "Até onde vai o sigilo?". Cada nó guarda o seu top
+# pronto, de modo que uma consulta é só descer len(prefixo) nós. Os pesos vêm
+# do histórico e são atualizados pela tarefa periódica, nunca por tecla.
+class PrefixTrie:
+    __slots__ = ("_root",)
+
+    def __init__(self, weights: dict[str, float], k: int = SUGGEST_MAX_K):
+        root = ({}, [])
+        for text, weight in weights.items():
+            words = _normalize_question(text).split()
+            for i in range(min(len(words), SUGGEST_MAX_WORDS)):
+                node = root
+                for ch in " ".join(words[i:])[:SUGGEST_SUFFIX_CHARS]:
+                    node = node[0].setdefault(ch, ({}, []))
+                    # Casar pelo começo da frase vale mais do que pelo meio.
+                    node[1].append((i > 0, -weight, len(text), text))
+        stack = [root]
+        while stack:
+            children, top = stack.pop()
+            seen, best = set(), []
+            for entry in sorted(top):
+                if entry[3] not in seen:
+                    seen.add(entry[3])
+                    best.append(entry[3])
+                    if len(best) == k:
+                        break
+            top[:] = best
+            stack.extend(children.values())
+        self._root = root
+
+    def search(self, prefix: str, k: int = SUGGEST_MAX_K) -> list[str]:
+        norm = _normalize_question(prefix)
+        node = self._root
+        for ch in norm[:SUGGEST_SUFFIX_CHARS]:
+            node = node[0].get(ch)
+            if node is None:
+                return []
+        if node is self._root:
+            return []
+        if len(norm) > SUGGEST_SUFFIX_CHARS:
+            # A trie só vai até SUGGEST_SUFFIX_CHARS: o resto do prefixo filtra.
+            return [t for t in node[1] if norm in _normalize_question(t)][:k]
+        return node[1][:k]
+
+_suggest_state = {"trie": None, "answers": None, "history": None}
+_suggest_lock = threading.Lock()
+
+def _history_popularity(limit: int = SUGGEST_HISTORY_TOP) -> dict[str, int]:
+    """Perguntas mais feitas (de todo o período), já agrupadas pela forma normalizada."""
+    return {item["question"]: item["count"] for item in top_questions(limit=limit)
+            if len(item["question"]) <= QUESTION_MAX_CHARS}
+
+def refresh_suggestions(history: dict[str, int] | None = None) -> PrefixTrie:
+    """Remonta a trie; sem `history`, relê a popularidade do banco."""
+    if history is None:
+        history = _history_popularity()
+    answers = RESPOSTAS_DB
+    weights = {}
+    canonical = {_normalize_question(q): q for q in list(QUICK_QUESTIONS) + list(answers)}
+    for q in canonical.values():
+        weights[q] = 1.0
+    for text, n in history.items():
+        # Pergunta do histórico que já é canônica soma no texto canônico.
+        q = canonical.get(_normalize_question(text), text)
+        weights[q] = weights.get(q, 0.0) + n
+    trie = PrefixTrie(weights)
+    with _suggest_lock:
+        _suggest_state.update(trie=trie, answers=answers, history=history)
+    return trie
+
+def suggest(prefix: str, k: int = SUGGEST_MAX_K) -> list[str]:
+    state = _suggest_state
+    trie = state["trie"]
+    if trie is None:
+        trie = refresh_suggestions()
+    elif state["answers"] is not RESPOSTAS_DB:
+        # respostas.json recarregado: mesma popularidade, chaves novas.
+        trie = refresh_suggestions(state["history"])
+    return trie.search(prefix, k)
 
 # =====================================================
 # INDEX e BUSCA (MANTIDOS PARA POSSÍVEL USO FUTURO)
 # =====================================================
-def index_content(title: str, text: str):
-    chunks = [c.strip() for c in text.split('\n') if len(c.strip()) > 20]
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO documents (title, created_at) VALUES (?,?)", (title, datetime.now().strftime("%Y-%m-%d")))
-    doc_id = cur.lastrowid
+# Subconsulta usada por toda leitura do corpus: só a geração ativa é visível.
+_ACTIVE_GEN = "(SELECT value FROM meta WHERE key = 'active_generation')"
+
+def active_generation() -> int:
+    row = db().execute(f"SELECT {_ACTIVE_GEN}").fetchone()
+    return row[0] or 0
+
+INDEX_BATCH_SIZE = 500
+
+def _split_lines(text: str) -> list[str]:
+    return [c.strip() for c in text.split('\n') if len(c.strip()) > 20]
+
+def _doc_hash(chunks) -> str:
+    h = hashlib.sha256()
     for c in chunks:
-        cur.execute("INSERT INTO chunks (doc_id, chunk_text) VALUES (?,?)", (doc_id, c))
-    conn.commit()
-    conn.close()
+        h.update(c.encode("utf-8") + b"\n")
+    return h.hexdigest()
+
+def upsert_document(title: str, chunks, generation: int | None = None,
+                    doc_hash: str | None = None, batch_size: int = INDEX_BATCH_SIZE) -> dict:
+    """Sincroniza o documento `title` com os chunks dados, numa única transação.
+
+    O documento é identificado pelo título dentro da geração. Só chunks com hash
+    novo são inseridos (executemany em lotes de batch_size) e os que sumiram são
+    apagados; `chunks` pode ser um gerador. Se doc_hash bater com o gravado,
+    nada é lido nem escrito.
+    Retorna {"doc_id", "inserted", "unchanged", "deleted"}.
+    """
+    with transaction() as conn:
+        gen = active_generation() if generation is None else generation
+        row = conn.execute(
+            "SELECT id, content_hash FROM documents WHERE generation = ? AND title = ? ORDER BY id DESC LIMIT 1",
+            (gen, title),
+        ).fetchone()
+        if row and doc_hash and row["content_hash"] == doc_hash:
+            n = conn.execute("SELECT COUNT(*) FROM chunks WHERE doc_id = ?", (row["id"],)).fetchone()[0]
+            return {"doc_id": row["id"], "inserted": 0, "unchanged": n, "deleted": 0}
+
+        if row:
+            doc_id = row["id"]
+            existing = dict(conn.execute("SELECT chunk_hash, id FROM chunks WHERE doc_id = ?", (doc_id,)).fetchall())
+        else:
+            doc_id = conn.execute(
+                "INSERT INTO documents (title, created_at, generation) VALUES (?,?,?)",
+                (title, datetime.now().strftime("%Y-%m-%d"), gen),
+            ).lastrowid
+            existing = {}
+
+        running = hashlib.sha256()
+        seen, batch = set(), []
+        inserted = unchanged = 0
+        for text in chunks:
+            running.update(text.encode("utf-8") + b"\n")
+            h = _chunk_hash(text)
+            if h in seen:
+                continue
+            seen.add(h)
+            if h in existing:
+                unchanged += 1
+                continue
+            batch.append((doc_id, text, gen, h))
+            if len(batch) >= batch_size:
+                conn.executemany("INSERT INTO chunks (doc_id, chunk_text, generation, chunk_hash) VALUES (?,?,?,?)", batch)
+                inserted += len(batch)
+                batch.clear()
+        if batch:
+            conn.executemany("INSERT INTO chunks (doc_id, chunk_text, generation, chunk_hash) VALUES (?,?,?,?)", batch)
+            inserted += len(batch)
+
+        stale = [(i,) for h, i in existing.items() if h not in seen]
+        conn.executemany("DELETE FROM chunks WHERE id = ?", stale)
+        conn.execute(
+            "UPDATE documents SET content_hash = ?, created_at = ? WHERE id = ?",
+            (running.hexdigest(), datetime.now().strftime("%Y-%m-%d"), doc_id),
+        )
+    if inserted or stale:
+        schedule_tfidf_update()
+    return {"doc_id": doc_id, "inserted": inserted, "unchanged": unchanged, "deleted": len(stale)}
+
+def index_content(title: str, text: str, generation: int | None = None) -> dict:
+    """Indexa (ou atualiza) um documento na geração ativa ou na indicada.
+
+    Retorna as contagens de upsert_document: inserted/unchanged/deleted.
+    """
+    chunks = _split_lines(text)
+    return upsert_document(title, chunks, generation=generation, doc_hash=_doc_hash(chunks))
 
-def simple_search(query: str):
-    conn = db()
+_SNIP_OPEN, _SNIP_CLOSE = "\x02", "\x03"
+
+def _highlight(snippet: str) -> str:
+    """Escapa o trecho e troca os marcadores do snippet() por <mark>."""
+    return _html_escape(snippet).replace(_SNIP_OPEN, "<mark>").replace(_SNIP_CLOSE, "</mark>")
+
+def _search_keywords(query: str) -> list[str]:
     terms = (query or "").lower().split()
-    keywords = [t for t in terms if len(t) > 3]
+    words = ["".join(ch for ch in t if ch.isalnum()) for t in terms]
+    return [w for w in words if len(w) > 3]
+
+def simple_search(query: str, limit: int = 3) -> list[dict]:
+    """Busca trechos do corpus.
+
+    Com FTS5: ranking BM25 e snippet com <mark>. Sem FTS5: LIKE, sem ranking.
+    Cada item: {"chunk_text", "snippet" (HTML), "score"}.
+    """
+    keywords = _search_keywords(query)
     if not keywords:
         return []
 
-    sql = "SELECT chunk_text FROM chunks WHERE " + " OR ".join(["chunk_text LIKE ?"] * len(keywords))
-    params = [f"%{k}%" for k in keywords]
-
-    rows = conn.execute(sql, params).fetchall()
-    conn.close()
+    if _fts_enabled():
+        match = " OR ".join(f'"{k}"*' for k in keywords)
+        rows = db().execute(
+            f"""SELECT c.chunk_text,
+                       snippet(chunks_fts, 0, '{_SNIP_OPEN}', '{_SNIP_CLOSE}', '…', 24) AS snip,
+                       bm25(chunks_fts) AS score
+                FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid
+                WHERE chunks_fts MATCH ? AND c.generation = {_ACTIVE_GEN}
+                ORDER BY score
+                LIMIT ?""",
+            (match, limit * 4),
+        ).fetchall()
+        results = [{"chunk_text": r[0], "snippet": _highlight(r[1]), "score": round(-r[2], 4)} for r in rows]
+    else:
+        sql = (f"SELECT chunk_text FROM chunks WHERE generation = {_ACTIVE_GEN} AND ("
+               + " OR ".join(["chunk_text LIKE ?"] * len(keywords)) + ")")
+        params = [f"%{k}%" for k in keywords]
+        rows = db().execute(sql, params).fetchall()
+        results = [{"chunk_text": r[0], "snippet": _html_escape(r[0]), "score": None} for r in rows]
 
     seen = set()
     unique_rows = []
-    for r in rows:
-        if r[0] not in seen:
-            unique_rows.append(r[0])
-            seen.add(r[0])
-    return unique_rows[:3]
+    for r in results:
+        if r["chunk_text"] not in seen:
+            unique_rows.append(r)
+            seen.add(r["chunk_text"])
+    return unique_rows[:limit]
+
+# =====================================================
+# BUSCA SEMÂNTICA (TF-IDF)
+# =====================================================
+# Matriz TF-IDF esparsa sobre chunks, persistida em TFIDF_DIR/v<N>/*.npy:
+#   csr_*  contagens por chunk (linha) -> usadas para atualizar incrementalmente;
+#   csc_*  pesos tf-idf normalizados por termo (coluna) -> usados na consulta,
+#          que só toca as postings dos termos da pergunta.
+# current.json aponta para a versão ativa e é trocado com os.replace, então
+# os workers abrem os arquivos com mmap e nunca veem uma versão pela metade.
+_PT_STOPWORDS = frozenset("""
+a ao aos as com como da das de dela dele deles do dos e ela elas ele eles em
+entre era essa esse esta este eu foi for ha isso isto ja la lhe mais mas me
+mesmo meu minha muito na nas nao no nos o os ou para pela pelas pelo pelos
+por pra qual quais quando que quem se sem ser seu seus sua suas so sobre
+tambem te tem um uma umas uns voce posso pode podem devo deve sou estou
+""".split())
+
+_PT_SUFFIXES = (
+    "amentos", "imentos", "amento", "imento", "idades", "acoes", "icoes", "ucoes",
+    "idade", "mente", "ancia", "encia", "acao", "icao", "ucao", "ismos", "istas",
+    "ismo", "ista", "avel", "ivel", "ivos", "ivas", "ados", "adas", "idos", "idas",
+    "ivo", "iva", "ado", "ada", "ido", "ida", "oes", "ais", "eis", "es", "ar",
+    "er", "ir", "as", "os", "a", "o", "e", "s",
+)
+
+def _pt_stem(word: str) -> str:
+    """Stemmer leve para português (remove o sufixo mais longo, stem >= 3)."""
+    for suf in _PT_SUFFIXES:
+        if word.endswith(suf) and len(word) - len(suf) >= 3:
+            return word[:-len(suf)]
+    return word
+
+def _tfidf_tokens(text: str) -> list[str]:
+    return [_pt_stem(w) for w in _normalize_question(text).split()
+            if len(w) > 1 and w not in _PT_STOPWORDS]
+
+_tfidf_cache = {"version": None, "checked": 0.0, "index": None}
+_tfidf_build_lock = threading.Lock()
+
+def _tfidf_manifest() -> dict | None:
+    try:
+        with open(os.path.join(TFIDF_DIR, "current.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _tfidf_load() -> dict | None:
+    """Índice ativo (mmap), recarregado quando current.json muda."""
+    if np is None:
+        return None
+    now = time.monotonic()
+    if _tfidf_cache["index"] is not None and now - _tfidf_cache["checked"] < 1.0:
+        return _tfidf_cache["index"]
+    _tfidf_cache["checked"] = now
+    manifest = _tfidf_manifest()
+    if manifest is None:
+        _tfidf_cache.update(version=None, index=None)
+        return None
+    if manifest["version"] == _tfidf_cache["version"]:
+        return _tfidf_cache["index"]
+
+    vdir = os.path.join(TFIDF_DIR, manifest["version"])
+    try:
+        index = {name: np.load(os.path.join(vdir, f"{name}.npy"), mmap_mode="r")
+                 for name in ("chunk_ids", "idf", "csc_indptr", "csc_rows", "csc_weights")}
+        with open(os.path.join(vdir, "vocab.json"), encoding="utf-8") as f:
+            vocab = json.load(f)
+    except (OSError, ValueError):
+        return None
+    index["vocab"] = {t: i for i, t in enumerate(vocab)}
+    index["manifest"] = manifest
+    _tfidf_cache.update(version=manifest["version"], index=index)
+    return index
+
+def _tfidf_weights(indptr, terms, counts, n_terms):
+    """Pesos (1 + log tf) * idf, normalizados por linha, e o vetor idf."""
+    n_rows = len(indptr) - 1
+    df = np.bincount(terms, minlength=n_terms).astype(np.float64)
+    idf = (np.log((1.0 + n_rows) / (1.0 + df)) + 1.0).astype(np.float32)
+    w = (1.0 + np.log(counts)) * idf[terms]
+    rows = np.repeat(np.arange(n_rows, dtype=np.int32), np.diff(indptr))
+    norms = np.sqrt(np.bincount(rows, weights=w * w, minlength=n_rows))
+    w = w / np.maximum(norms[rows], 1e-12)
+    return w.astype(np.float32), idf, rows
+
+def update_tfidf_index(full: bool = False) -> dict:
+    """Atualiza o índice com os chunks novos; refaz tudo se algum foi removido.
+
+    Só os chunks com id acima do último indexado são tokenizados. As contagens
+    antigas são reaproveitadas e os pesos (que dependem do idf global) são
+    recalculados de forma vetorizada.
+    """
+    if np is None:
+        return {"status": "numpy indisponível"}
+    with _tfidf_build_lock:
+        conn = db()
+        manifest = None if full else _tfidf_manifest()
+        if manifest is not None:
+            vdir = os.path.join(TFIDF_DIR, manifest["version"])
+            try:
+                chunk_ids = np.load(os.path.join(vdir, "chunk_ids.npy"))
+                indptr = np.load(os.path.join(vdir, "csr_indptr.npy"))
+                terms = np.load(os.path.join(vdir, "csr_terms.npy"))
+                counts = np.load(os.path.join(vdir, "csr_counts.npy"))
+                with open(os.path.join(vdir, "vocab.json"), encoding="utf-8") as f:
+                    vocab = json.load(f)
+                max_id = manifest["max_chunk_id"]
+            except (OSError, ValueError):
+                return _tfidf_rebuild(conn)
+            # Qualquer chunk apagado (ou troca de geração) desde o último build
+            # invalida as linhas antigas.
+            if (manifest.get("removed"), manifest.get("generation")) != (_chunks_removed(conn), active_generation()):
+                return _tfidf_rebuild(conn)
+            return _tfidf_append(conn, vocab, indptr, terms, counts, chunk_ids, max_id, force_write=False)
+        return _tfidf_rebuild(conn)
+
+def _chunks_removed(conn) -> int:
+    row = conn.execute("SELECT value FROM counters WHERE name = 'chunks_removed'").fetchone()
+    return row[0] if row else 0
+
+def _tfidf_rebuild(conn) -> dict:
+    return _tfidf_append(conn, [], np.zeros(1, np.int64), np.zeros(0, np.int32),
+                         np.zeros(0, np.float32), np.zeros(0, np.int64), 0, force_write=True)
+
+def _tfidf_append(conn, vocab, indptr, terms, counts, chunk_ids, max_id, force_write: bool) -> dict:
+    removed = _chunks_removed(conn)
+    generation = active_generation()
+    term_ids = {t: i for i, t in enumerate(vocab)}
+    new_ids, new_ptr, new_terms, new_counts = [], [], [], []
+    cur = conn.execute("SELECT id, chunk_text FROM chunks WHERE id > ? AND generation = ? ORDER BY id",
+                       (max_id, generation))
+    nnz = int(indptr[-1])
+    for chunk_id, text in cur:
+        tf = defaultdict(int)
+        for tok in _tfidf_tokens(text):
+            tf[term_ids.setdefault(tok, len(term_ids))] += 1
+        new_ids.append(chunk_id)
+        new_terms.extend(tf.keys())
+        new_counts.extend(tf.values())
+        nnz += len(tf)
+        new_ptr.append(nnz)
+        max_id = chunk_id
+
+    if new_ids:
+        vocab = list(term_ids)
+        chunk_ids = np.concatenate([chunk_ids, np.asarray(new_ids, np.int64)])
+        indptr = np.concatenate([indptr, np.asarray(new_ptr, np.int64)])
+        terms = np.concatenate([terms, np.asarray(new_terms, np.int32)])
+        counts = np.concatenate([counts, np.asarray(new_counts, np.float32)])
+    elif not force_write:
+        return {"status": "ok", "added": 0, "chunks": int(len(chunk_ids))}
+
+    weights, idf, rows = _tfidf_weights(indptr, terms, counts, len(vocab))
+    # CSC: ordena as entradas por termo para ter as postings contíguas.
+    order = np.argsort(terms, kind="stable")
+    csc_indptr = np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=len(vocab)))]).astype(np.int64)
+
+    version = f"v{int(time.time() * 1000)}-{os.getpid()}"
+    vdir = os.path.join(TFIDF_DIR, version)
+    os.makedirs(vdir, exist_ok=True)
+    arrays = {
+        "chunk_ids": chunk_ids, "csr_indptr": indptr, "csr_terms": terms, "csr_counts": counts,
+        "idf": idf, "csc_indptr": csc_indptr, "csc_rows": rows[order], "csc_weights": weights[order],
+    }
+    for name, arr in arrays.items():
+        np.save(os.path.join(vdir, f"{name}.npy"), arr)
+    with open(os.path.join(vdir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+
+    manifest = {"version": version, "max_chunk_id": int(max_id), "chunks": int(len(chunk_ids)),
+                "removed": removed, "generation": generation, "terms": len(vocab)}
+    tmp = os.path.join(TFIDF_DIR, f"current.json.{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(TFIDF_DIR, "current.json"))
+    _tfidf_cleanup(keep=version)
+    return {"status": "ok", "added": len(new_ids), "chunks": int(len(chunk_ids))}
+
+def _tfidf_cleanup(keep: str):
+    # Mantém a versão anterior: algum worker pode ainda estar com ela em mmap.
+    versions = sorted(d for d in os.listdir(TFIDF_DIR) if d.startswith("v") and d != keep)
+    for old in versions[:-1]:
+        shutil.rmtree(os.path.join(TFIDF_DIR, old), ignore_errors=True)
+
+def schedule_tfidf_update():
+    """Atualiza o índice numa thread, sem segurar quem chamou."""
+    if np is None:
+        return
+
+    def run():
+        try:
+            update_tfidf_index()
+        except Exception:
+            app.logger.exception("Falha ao atualizar o índice TF-IDF")
+        finally:
+            close_db()
+
+    threading.Thread(target=run, name="tfidf-update", daemon=True).start()
+
+def semantic_search_batch(queries: list[str], k: int = 3) -> list[list[tuple[int, float]]] | None:
+    """Top-k (chunk_id, cosseno) para várias perguntas de uma vez.
+
+    Monta uma matriz densa (perguntas x chunks) de scores acumulando as
+    postings de cada termo; None se não houver índice.
+    """
+    index = _tfidf_load()
+    if index is None or not len(index["chunk_ids"]):
+        return None
+    vocab, idf = index["vocab"], index["idf"]
+    ptr, rows, weights = index["csc_indptr"], index["csc_rows"], index["csc_weights"]
+    scores = np.zeros((len(queries), len(index["chunk_ids"])), dtype=np.float32)
+    for qi, text in enumerate(queries):
+        tf = defaultdict(int)
+        for tok in _tfidf_tokens(text):
+            if tok in vocab:
+                tf[vocab[tok]] += 1
+        if not tf:
+            continue
+        q_terms = np.fromiter(tf.keys(), dtype=np.int64)
+        q_w = (1.0 + np.log(np.fromiter(tf.values(), dtype=np.float32))) * idf[q_terms]
+        q_w /= max(float(np.sqrt((q_w * q_w).sum())), 1e-12)
+        for t, w in zip(q_terms, q_w):
+            a, b = ptr[t], ptr[t + 1]
+            # Um chunk aparece no máximo uma vez por termo: += indexado é seguro.
+            scores[qi, rows[a:b]] += weights[a:b] * w
+
+    k = max(1, min(k, scores.shape[1]))
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    out = []
+    for qi in range(len(queries)):
+        idx = top[qi][np.argsort(-scores[qi, top[qi]])]
+        out.append([(int(index["chunk_ids"][i]), float(scores[qi, i])) for i in idx if scores[qi, i] > 0])
+    return out
+
+@timed("search")
+def semantic_search(query: str, k: int = 3) -> list[dict]:
+    """Trechos mais parecidos (cosseno TF-IDF); cai no simple_search sem índice."""
+    batch = semantic_search_batch([query], k)
+    if batch is None:
+        return simple_search(query, limit=k)
+    hits = batch[0]
+    if not hits:
+        return []
+    marks = ",".join("?" * len(hits))
+    texts = dict(db().execute(f"SELECT id, chunk_text FROM chunks WHERE id IN ({marks})", [h[0] for h in hits]).fetchall())
+    return [
+        {"chunk_text": texts[cid], "snippet": _html_escape(texts[cid]), "score": round(score, 4)}
+        for cid, score in hits if cid in texts
+    ]
+
+# =====================================================
+# REINDEXAÇÃO (BLUE-GREEN)
+# =====================================================
+# A nova geração é montada em lotes curtos, invisível para as buscas (que filtram
+# pela geração ativa). A troca é um único UPDATE em meta, junto com o acerto dos
+# contadores; a geração antiga é apagada depois, também em lotes. O progresso
+# fica em meta para que qualquer worker consiga exibi-lo no /admin.
+REINDEX_STALE_SECONDS = 30 * 60  # job "running" há mais tempo que isso é considerado morto
+
+def _corpus_sources() -> list[tuple[str, str]]:
+    """Documentos que compõem a base: [(título, texto)]."""
+    return [("Código de Ética (Resumo)", TEXTO_CODIGO_ETICA)]
+
+def reindex_progress() -> dict:
+    row = db().execute("SELECT value FROM meta WHERE key = 'reindex_progress'").fetchone()
+    if not row:
+        return {"state": "idle"}
+    return json.loads(row[0])
+
+def _set_reindex_progress(conn, progress: dict):
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('reindex_progress', ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (json.dumps(progress),),
+    )
+
+def start_reindex() -> bool:
+    """Dispara a reindexação numa thread. False se já há uma em andamento."""
+    with transaction() as conn:
+        current = reindex_progress()
+        if current.get("state") == "running" and time.time() - current.get("updated", 0) < REINDEX_STALE_SECONDS:
+            return False
+        gen = conn.execute(
+            "SELECT MAX(COALESCE(MAX(generation), 0), " + _ACTIVE_GEN + ") + 1 FROM chunks"
+        ).fetchone()[0]
+        sources = _corpus_sources()
+        progress = {"state": "running", "generation": gen, "docs_done": 0, "docs_total": len(sources),
+                    "started": time.time(), "updated": time.time()}
+        _set_reindex_progress(conn, progress)
+
+    def run():
+        try:
+            _run_reindex(gen, sources, progress)
+        except Exception as e:
+            app.logger.exception("Reindexação falhou")
+            progress.update(state="error", error=str(e), updated=time.time())
+            with transaction() as conn:
+                _set_reindex_progress(conn, progress)
+        finally:
+            close_db()
+
+    threading.Thread(target=run, name="reindex", daemon=True).start()
+    return True
+
+def _carry_over_documents(conn, gen: int, skip_titles: set[str]) -> int:
+    """Copia para `gen` os documentos da geração ativa que não vêm de _corpus_sources
+    (fontes oficiais coletadas, PDFs enviados), com os mesmos chunks.
+
+    Cópia com o mesmo content_hash é mantida; então a segunda chamada, já na
+    transação da troca, só pega o que foi gravado durante a reindexação.
+    """
+    copied = 0
+    rows = conn.execute(
+        f"SELECT id, title, created_at, content_hash FROM documents WHERE generation = {_ACTIVE_GEN}"
+    ).fetchall()
+    for row in rows:
+        if row["title"] in skip_titles:
+            continue
+        current = conn.execute(
+            "SELECT id, content_hash FROM documents WHERE generation = ? AND title = ?", (gen, row["title"])
+        ).fetchone()
+        if current and current["content_hash"] == row["content_hash"]:
+            continue
+        if current:
+            conn.execute("DELETE FROM chunks WHERE doc_id = ?", (current["id"],))
+            conn.execute("DELETE FROM documents WHERE id = ?", (current["id"],))
+        doc_id = conn.execute(
+            "INSERT INTO documents (title, created_at, content_hash, generation) VALUES (?,?,?,?)",
+            (row["title"], row["created_at"], row["content_hash"], gen),
+        ).lastrowid
+        conn.execute(
+            "INSERT INTO chunks (doc_id, chunk_text, generation, chunk_hash) "
+            "SELECT ?, chunk_text, ?, chunk_hash FROM chunks WHERE doc_id = ?",
+            (doc_id, gen, row["id"]),
+        )
+        copied += 1
+    return copied
+
+def _run_reindex(gen: int, sources: list[tuple[str, str]], progress: dict):
+    for title, text in sources:
+        index_content(title, text, generation=gen)
+        progress.update(docs_done=progress["docs_done"] + 1, updated=time.time())
+        with transaction() as conn:
+            _set_reindex_progress(conn, progress)
+
+    # O que não sai de _corpus_sources (fontes coletadas, PDFs) vai junto para a nova geração.
+    skip = {title for title, _ in sources}
+    with transaction() as conn:
+        carried = _carry_over_documents(conn, gen, skip)
+
+    # Troca atômica: leitores veem a geração antiga inteira ou a nova inteira.
+    with transaction() as conn:
+        carried += _carry_over_documents(conn, gen, skip)
+        progress["docs_carried"] = carried
+        conn.execute("UPDATE meta SET value = ? WHERE key = 'active_generation'", (gen,))
+        for table in ("documents", "chunks"):
+            conn.execute(
+                f"UPDATE counters SET value = (SELECT COUNT(*) FROM {table} WHERE generation = ?) WHERE name = ?",
+                (gen, table),
+            )
+        progress.update(state="done", finished=time.time(), updated=time.time())
+        _set_reindex_progress(conn, progress)
+    purge_inactive_generations()
+    schedule_tfidf_update()
+
+def purge_inactive_generations(batch_size: int = 1000) -> int:
+    """Apaga, em lotes, chunks/documentos de gerações que não são a ativa nem a em construção."""
+    conn = db()
+    removed = 0
+    progress = reindex_progress()
+    building = progress.get("generation") if progress.get("state") == "running" else None
+    for table in ("chunks", "documents"):
+        while True:
+            with transaction():
+                cur = conn.execute(
+                    f"""DELETE FROM {table} WHERE id IN (
+                            SELECT id FROM {table}
+                            WHERE generation != {_ACTIVE_GEN} AND generation IS NOT ?
+                            LIMIT ?)""",
+                    (building, batch_size),
+                )
+            removed += cur.rowcount
+            if cur.rowcount < batch_size:
+                break
+    return removed
+
+# =====================================================
+# INGESTÃO DE PDF (RESOLUÇÕES DO CFP)
+# =====================================================
+# Páginas -> texto (lazy; em paralelo para arquivos grandes) -> chunks por
+# artigo/parágrafo (gerador) -> arquivo temporário -> upsert_document em lotes.
+# O arquivo temporário mantém a memória constante e faz com que o lock de
+# escrita só seja segurado durante a gravação, não durante a extração.
+_RE_BREAK_CHUNK = re.compile(r"^(art\.?|artigo)\s*\d+|^(cap[íi]tulo|se[çc][ãa]o|t[íi]tulo)\b", re.IGNORECASE)
+# Incisos: algarismo romano em maiúsculas (I, IV, XII...), para não pegar "civil.".
+_RE_BREAK_PARA = re.compile(
+    r"^(§\s*\d+|par[áa]grafo [úu]nico|[a-z]\)|(?-i:(?=[IVXL])(?:XC|XL|L?X{0,3})(?:IX|IV|V?I{0,3}))\s*[-–.])",
+    re.IGNORECASE)
+
+def _extract_page_range(path: str, start: int, stop: int) -> list[str]:
+    """Texto das páginas [start, stop). Roda no processo filho do pool."""
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    return [(reader.pages[i].extract_text() or "") for i in range(start, stop)]
+
+def iter_pdf_pages(path: str):
+    """Gera o texto de cada página, na ordem.
+
+    Arquivos com PDF_PARALLEL_MIN_PAGES páginas ou mais são extraídos por um
+    pool de processos, com no máximo 2 lotes por worker em voo, para não
+    acumular o documento inteiro na memória.
+    """
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    n = len(reader.pages)
+    if n < PDF_PARALLEL_MIN_PAGES or PDF_MAX_WORKERS <= 1:
+        for page in reader.pages:
+            yield page.extract_text() or ""
+        return
+    del reader
+
+    ranges = [(i, min(i + PDF_PAGES_PER_TASK, n)) for i in range(0, n, PDF_PAGES_PER_TASK)]
+    window = PDF_MAX_WORKERS * 2
+    # spawn: o processo atual pode ter threads (gunicorn, write-behind).
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=PDF_MAX_WORKERS, mp_context=ctx) as pool:
+        pending = []
+        for start, stop in ranges:
+            pending.append(pool.submit(_extract_page_range, path, start, stop))
+            if len(pending) >= window:
+                yield from pending.pop(0).result()
+        for fut in pending:
+            yield from fut.result()
+
+def iter_legal_chunks(pages, max_chars: int = CHUNK_MAX_CHARS):
+    """Agrupa o texto em chunks que respeitam artigos e parágrafos.
+
+    Um artigo (ou capítulo/seção) sempre abre um chunk novo; parágrafos,
+    incisos e alíneas ficam no chunk do artigo até max_chars. Linhas quebradas
+    pelo PDF são reunidas, inclusive palavras hifenizadas.
+    """
+    paras, para, size = [], "", 0
+
+    def end_para():
+        nonlocal para, size
+        if para:
+            paras.append(para)
+            size += len(para)
+        para = ""
+
+    def flush():
+        nonlocal paras, size
+        end_para()
+        text = "\n".join(paras).strip()
+        paras, size = [], 0
+        return text
+
+    for page in pages:
+        for raw in page.splitlines():
+            line = " ".join(raw.split())
+            if not line:
+                end_para()
+                continue
+            if _RE_BREAK_CHUNK.match(line):
+                text = flush()
+                if len(text) > 20:
+                    yield text
+            elif _RE_BREAK_PARA.match(line):
+                end_para()
+                if size >= max_chars:
+                    text = flush()
+                    if len(text) > 20:
+                        yield text
+            if para.endswith("-"):
+                para = para[:-1] + line
+            else:
+                para = f"{para} {line}" if para else line
+            while len(para) >= max_chars:
+                # Parágrafo gigante: corta no último ponto final. A cabeça sai
+                # num chunk (junto do que já estava aberto, se couber) e o resto
+                # segue como parágrafo aberto.
+                cut = para.rfind(". ", 0, max_chars)
+                cut = cut + 1 if cut > 0 else max_chars
+                head, para = para[:cut].strip(), para[cut:].strip()
+                if paras and size + len(paras) + len(head) > max_chars:
+                    text = "\n".join(paras).strip()
+                    paras, size = [], 0
+                    if len(text) > 20:
+                        yield text
+                paras.append(head)
+                text = "\n".join(paras).strip()
+                paras, size = [], 0
+                if len(text) > 20:
+                    yield text
+    text = flush()
+    if len(text) > 20:
+        yield text
+
+def _spool(chunks):
+    """Grava os chunks num arquivo temporário e devolve um gerador que os relê."""
+    f = tempfile.TemporaryFile("w+", encoding="utf-8")
+    for c in chunks:
+        f.write(json.dumps(c, ensure_ascii=False) + "\n")
+    f.seek(0)
+
+    def read_back():
+        with f:
+            for line in f:
+                yield json.loads(line)
+    return read_back()
+
+def ingest_pdf(path: str, title: str | None = None) -> dict:
+    """Extrai, fatia e indexa um PDF (upsert pelo título). Retorna as contagens."""
+    title = title or os.path.splitext(os.path.basename(path))[0]
+    t0 = time.perf_counter()
+    chunks = _spool(iter_legal_chunks(iter_pdf_pages(path)))
+    result = upsert_document(title, chunks)
+    result.update(title=title, seconds=round(time.perf_counter() - t0, 2))
+    return result
+
+def _set_meta_json(key: str, value: dict):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value, ensure_ascii=False)),
+        )
+
+def last_ingest() -> dict | None:
+    row = db().execute("SELECT value FROM meta WHERE key = 'last_ingest'").fetchone()
+    return json.loads(row[0]) if row else None
+
+def start_pdf_ingest(path: str, title: str | None = None):
+    """Ingestão em segundo plano; o resultado aparece no /admin (meta.last_ingest)."""
+    def run():
+        try:
+            result = ingest_pdf(path, title)
+        except Exception as e:
+            app.logger.exception("Falha ao ingerir %s", path)
+            result = {"title": title or os.path.basename(path), "error": str(e)}
+        result["finished"] = datetime.now().isoformat(timespec="seconds")
+        try:
+            _set_meta_json("last_ingest", result)
+        finally:
+            close_db()
+
+    threading.Thread(target=run, name="pdf-ingest", daemon=True).start()
+
+# =====================================================
+# COLETA DAS FONTES OFICIAIS (WEB)
+# =====================================================
+# Uma requests.Session por processo (pool de conexões keep-alive), GET
+# condicional com ETag/Last-Modified e cache em disco (FETCH_CACHE_DIR): página
+# sem mudança custa um 304, e sem rede usamos a última cópia. Roda só em
+# threads de fundo (tarefa periódica ou botão do /admin).
+try:
+    from selectolax.parser import HTMLParser as _FastHTMLParser
+except ImportError:  # bs4 (requirements.txt) dá conta sozinho
+    _FastHTMLParser = None
+
+_HTML_BLOCKS = "h1, h2, h3, h4, p, li, td, th"
+_HTML_DROP = "script, style, nav, header, footer, form, noscript"
+
+_http_state = {"pid": None, "session": None}
+
+def http_session():
+    if _http_state["pid"] != os.getpid():
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = requests.Session()
+        retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["User-Agent"] = f"{APP_NAME}/1.0 (+fontes oficiais CFP)"
+        _http_state.update(pid=os.getpid(), session=session)
+    return _http_state["session"]
+
+def _fetch_cache_paths(url: str) -> tuple[str, str]:
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:24]
+    return os.path.join(FETCH_CACHE_DIR, f"{key}.json"), os.path.join(FETCH_CACHE_DIR, f"{key}.body")
+
+def _write_atomic(path: str, data: bytes):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def fetch_url(url: str, min_interval: float = 0) -> dict:
+    """Baixa `url` usando o cache em disco.
+
+    Retorna {"url", "status", "changed", "path", "content_type"}, em que status
+    é "fetched", "not_modified", "fresh" (checado há menos de min_interval
+    segundos, sem request) ou "offline" (falha de rede, cópia do cache).
+    """
+    import requests
+
+    os.makedirs(FETCH_CACHE_DIR, exist_ok=True)
+    meta_path, body_path = _fetch_cache_paths(url)
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = None
+    if meta and not os.path.exists(body_path):
+        meta = None
+
+    def result(status, changed):
+        return {"url": url, "status": status, "changed": changed, "path": body_path,
+                "content_type": meta.get("content_type", "")}
+
+    if meta and min_interval and time.time() - meta["checked"] < min_interval:
+        return result("fresh", False)
+
+    headers = {}
+    if meta and meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta and meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        r = http_session().get(url, headers=headers, timeout=FETCH_TIMEOUT)
+    except requests.RequestException:
+        if meta:
+            return result("offline", False)
+        raise
+
+    if r.status_code == 304 and meta:
+        meta["checked"] = time.time()
+        _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        return result("not_modified", False)
+    r.raise_for_status()
+
+    body = r.content
+    digest = hashlib.sha256(body).hexdigest()
+    changed = not meta or meta.get("sha256") != digest
+    _write_atomic(body_path, body)
+    meta = {
+        "url": url,
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "content_type": r.headers.get("Content-Type", ""),
+        "sha256": digest,
+        "checked": time.time(),
+    }
+    _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+    return result("fetched", changed)
+
+def html_to_chunks(html: bytes):
+    """Texto dos blocos (títulos, parágrafos, itens, células) da página, em chunks."""
+    if _FastHTMLParser is not None:
+        tree = _FastHTMLParser(html)
+        for node in tree.css(_HTML_DROP):
+            node.decompose()
+        root = tree.css_first("main") or tree.css_first("article") or tree.body
+        blocks = [n.text(separator=" ") for n in root.css(_HTML_BLOCKS)] if root else []
+    else:
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, "html.parser")
+        for node in soup.select(_HTML_DROP):
+            node.decompose()
+        root = soup.find("main") or soup.find("article") or soup.body or soup
+        blocks = [n.get_text(" ") for n in root.select(_HTML_BLOCKS)]
+    # Parágrafos separados por linha em branco: iter_legal_chunks agrupa por artigo/tamanho.
+    text = "\n\n".join(" ".join(b.split()) for b in blocks if b and b.strip())
+    return iter_legal_chunks([text])
+
+def refresh_official_sources(sources: dict | None = None, force: bool = False) -> list[dict]:
+    """Atualiza e indexa as fontes oficiais; só reindexa o que mudou."""
+    sources = LINKS_OFICIAIS if sources is None else sources
+    results = []
+    for key, url in sources.items():
+        item = {"source": key, "url": url}
+        try:
+            fetched = fetch_url(url, min_interval=0 if force else FETCH_INTERVAL_SECONDS / 2)
+            item["status"] = fetched["status"]
+            title = f"Fonte oficial: {key}"
+            # Sem documento na geração ativa (ex.: base reindexada antes da cópia
+            # de documentos existir): reindexa a partir do cache em disco.
+            missing = db().execute(
+                f"SELECT 1 FROM documents WHERE generation = {_ACTIVE_GEN} AND title = ?", (title,)
+            ).fetchone() is None
+            if fetched["changed"] or force or missing:
+                if "pdf" in fetched["content_type"] or url.lower().endswith(".pdf"):
+                    item.update(ingest_pdf(fetched["path"], title))
+                else:
+                    with open(fetched["path"], "rb") as f:
+                        item.update(upsert_document(title, _spool(html_to_chunks(f.read()))))
+        except Exception as e:
+            app.logger.warning("Falha ao coletar %s: %s", url, e)
+            item["error"] = str(e)
+        results.append(item)
+    return results
+
+def start_sources_refresh(force: bool = False):
+    def run():
+        try:
+            results = refresh_official_sources(force=force)
+            _set_meta_json("last_fetch", {"finished": datetime.now().isoformat(timespec="seconds"), "results": results})
+        except Exception:
+            app.logger.exception("Falha ao coletar fontes oficiais")
+        finally:
+            close_db()
+
+    threading.Thread(target=run, name="sources-refresh", daemon=True).start()
+
+def last_fetch() -> dict | None:
+    row = db().execute("SELECT value FROM meta WHERE key = 'last_fetch'").fetchone()
+    return json.loads(row[0]) if row else None
 
 # =====================================================
 # FERRAMENTAS (CONTRATO, HONORARIOS, POLITICAS, REDE)
@@ -625,17 +2328,44 @@ Observação
 Este documento é um modelo informacional e pode ser adaptado conforme contexto e critérios profissionais.
 """
 
-def calc_honorarios(d: dict) -> dict:
-    custos_fixos = float(d.get("custos_fixos", 0) or 0)
-    custos_variaveis_mes = float(d.get("custos_variaveis_mes", 0) or 0)
-    pro_labore = float(d.get("pro_labore", 0) or 0)
-    impostos_perc = float(d.get("impostos_perc", 0) or 0) / 100.0
-    semanas_mes = float(d.get("semanas_mes", 4.3) or 4.3)
+HONORARIOS_VALOR_MAX = 1e12  # acima disso (ou inf/nan) o cálculo só produziria overflow
 
-    sessoes_semana = float(d.get("sessoes_semana", 0) or 0)
-    duracao_min = float(d.get("duracao_min", 50) or 50)
-    admin_min = float(d.get("admin_min", 10) or 10)
-    faltas_perc = float(d.get("faltas_perc", 0) or 0) / 100.0
+def _numero(value) -> float:
+    """float finito e de tamanho razoável; ValueError caso contrário."""
+    x = float(value)
+    if not math.isfinite(x) or abs(x) > HONORARIOS_VALOR_MAX:
+        raise ValueError(value)
+    return x
+
+def _honorarios_inputs(d: dict) -> dict:
+    """Lê os campos do formulário (percentuais já em fração); usado pelo cálculo e pelos cenários."""
+    return {
+        "custos_fixos": _numero(d.get("custos_fixos", 0) or 0),
+        "custos_variaveis_mes": _numero(d.get("custos_variaveis_mes", 0) or 0),
+        "pro_labore": _numero(d.get("pro_labore", 0) or 0),
+        "impostos_perc": _numero(d.get("impostos_perc", 0) or 0) / 100.0,
+        "semanas_mes": _numero(d.get("semanas_mes", 4.3) or 4.3),
+        "sessoes_semana": _numero(d.get("sessoes_semana", 0) or 0),
+        "duracao_min": _numero(d.get("duracao_min", 50) or 50),
+        "admin_min": _numero(d.get("admin_min", 10) or 10),
+        "faltas_perc": _numero(d.get("faltas_perc", 0) or 0) / 100.0,
+    }
+
+def calc_honorarios(d: dict) -> dict:
+    try:
+        p = _honorarios_inputs(d)
+    except (TypeError, ValueError):
+        return {"ok": False, "erro": "Valores inválidos. Use números (sem infinito)."}
+    custos_fixos = p["custos_fixos"]
+    custos_variaveis_mes = p["custos_variaveis_mes"]
+    pro_labore = p["pro_labore"]
+    impostos_perc = p["impostos_perc"]
+    semanas_mes = p["semanas_mes"]
+
+    sessoes_semana = p["sessoes_semana"]
+    duracao_min = p["duracao_min"]
+    admin_min = p["admin_min"]
+    faltas_perc = p["faltas_perc"]
 
     custo_total_mes = custos_fixos + custos_variaveis_mes + pro_labore
     sessoes_mes_brutas = sessoes_semana * semanas_mes
@@ -669,6 +2399,143 @@ def calc_honorarios(d: dict) -> dict:
         "receita_por_hora_bruta": round(receita_por_hora_bruta, 2),
     }
 
+# -----------------------------------------------------
+# Honorários: cenários (NumPy)
+# -----------------------------------------------------
+# Mesmas fórmulas e mesmas regras de calc_honorarios, aplicadas de uma vez a
+# todos os cenários. Cada campo varrido vira um eixo; os demais ficam fixos.
+# Cenários que o cálculo escalar recusaria (nenhuma sessão efetiva) viram NaN
+# e ficam fora das faixas.
+SWEEP_FIELDS = ("sessoes_semana", "faltas_perc", "impostos_perc", "custos_fixos")
+SWEEP_PERCENTILES = (5, 25, 50, 75, 95)
+_PERC_FIELDS = ("faltas_perc", "impostos_perc")
+
+def _parse_faixa(value) -> list[float] | None:
+    """"de:até:passo", "10,15,20" ou lista JSON de valores."""
+    if value is None or value == "" or value == []:
+        return None
+    if isinstance(value, str):
+        if ":" in value:
+            de, ate, passo = (_numero(x) for x in value.split(":"))
+            if passo <= 0 or ate < de or (ate - de) / passo > SWEEP_MAX_SCENARIOS:
+                raise ValueError(value)
+            # Meio passo de folga para o "até" entrar apesar do arredondamento.
+            return np.arange(de, ate + passo / 2, passo).tolist()
+        value = value.split(",")
+    if len(value) > SWEEP_MAX_SCENARIOS:
+        raise ValueError("faixa longa demais")
+    return [_numero(x) for x in value]
+
+def _honorarios_arrays(p: dict) -> dict:
+    custo_total_mes = p["custos_fixos"] + p["custos_variaveis_mes"] + p["pro_labore"]
+    sessoes_mes_brutas = p["sessoes_semana"] * p["semanas_mes"]
+    sessoes_mes_liquidas = np.maximum(0.0, sessoes_mes_brutas * (1.0 - p["faltas_perc"]))
+    valido = sessoes_mes_liquidas > 0
+    impostos = np.minimum(p["impostos_perc"], 0.95)
+    receita_bruta_necessaria = custo_total_mes / np.maximum(0.01, 1.0 - impostos)
+    preco = np.where(valido, receita_bruta_necessaria / np.where(valido, sessoes_mes_liquidas, 1.0), np.nan)
+    horas = (p["duracao_min"] + p["admin_min"]) * sessoes_mes_brutas / 60.0
+    horas = np.where(horas <= 0, 0.1, horas)
+    return {"preco_min_sessao": preco, "receita_por_hora_bruta": preco * sessoes_mes_liquidas / horas}
+
+def _bands(values) -> dict:
+    ok = values[~np.isnan(values)]
+    out = {f"p{q}": round(float(v), 2) for q, v in zip(SWEEP_PERCENTILES, np.percentile(ok, SWEEP_PERCENTILES))}
+    out.update(min=round(float(ok.min()), 2), max=round(float(ok.max()), 2))
+    return out
+
+def calc_honorarios_cenarios(d: dict) -> dict:
+    """Preço mínimo por sessão em uma grade de cenários ou em N sorteios da taxa de faltas.
+
+    Faixas: `<campo>_faixa` para campos de SWEEP_FIELDS. Monte-Carlo: `amostras`
+    (N) e `faltas_dp` (desvio-padrão em pontos percentuais, média = faltas_perc);
+    as faltas são sorteadas de uma Beta e combinadas com a grade das demais faixas.
+    """
+    if np is None:
+        return {"ok": False, "erro": "Cenários indisponíveis: instale o numpy."}
+    started = time.perf_counter()
+    try:
+        base = _honorarios_inputs(d)
+        faixas = {}
+        for field in SWEEP_FIELDS:
+            values = _parse_faixa(d.get(f"{field}_faixa"))
+            if values:
+                faixas[field] = values
+        amostras = int(d.get("amostras", 0) or 0)
+        faltas_dp = _numero(d.get("faltas_dp", 5) or 5) / 100.0
+        seed = d.get("seed")
+        seed = int(seed) if seed not in (None, "") else None
+        if seed is not None and seed < 0:
+            raise ValueError(seed)
+    except (TypeError, ValueError):
+        return {"ok": False, "erro": "Valores inválidos. Faixas usam \"de:até:passo\" ou uma lista de números."}
+
+    if amostras > 0:
+        faixas.pop("faltas_perc", None)
+    # Tamanho da grade antes de alocar qualquer coisa (inclusive os sorteios).
+    total = amostras if amostras > 0 else 1
+    for values in faixas.values():
+        total *= len(values)
+    if total > SWEEP_MAX_SCENARIOS:
+        return {"ok": False, "erro": f"Muitos cenários ({total}); o limite é {SWEEP_MAX_SCENARIOS}."}
+    axes = []
+    for field in SWEEP_FIELDS:
+        if field in faixas:
+            values = np.asarray(faixas[field], dtype=np.float64)
+            axes.append(values / 100.0 if field in _PERC_FIELDS else values)
+        else:
+            axes.append(np.asarray([base[field]]))
+
+    if amostras > 0:
+        m, var = base["faltas_perc"], faltas_dp ** 2
+        if not (0.0 < m < 1.0) or var <= 0 or var >= m * (1.0 - m):
+            return {"ok": False, "erro": "Para sortear faltas, use média entre 0 e 100% e um desvio-padrão menor."}
+        k = m * (1.0 - m) / var - 1.0
+        axes[SWEEP_FIELDS.index("faltas_perc")] = np.random.default_rng(seed).beta(m * k, (1.0 - m) * k, amostras)
+
+    # Cada eixo ocupa a sua dimensão; o broadcasting monta a grade sem copiar.
+    p = dict(base)
+    for i, (field, values) in enumerate(zip(SWEEP_FIELDS, axes)):
+        shape = [1] * len(axes)
+        shape[i] = len(values)
+        p[field] = values.reshape(shape)
+    out = _honorarios_arrays(p)
+    preco = np.broadcast_to(out["preco_min_sessao"], [len(a) for a in axes])
+    por_hora = np.broadcast_to(out["receita_por_hora_bruta"], preco.shape)
+
+    validos = int(np.count_nonzero(~np.isnan(preco)))
+    if not validos:
+        return {"ok": False, "erro": "Defina sessões por semana e faltas em um valor que gere ao menos 1 sessão/mês efetiva."}
+
+    sensibilidade = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # fatias só com cenários inválidos
+        for i, field in enumerate(SWEEP_FIELDS):
+            if field not in faixas or len(faixas[field]) < 2:
+                continue
+            rows = np.nanpercentile(np.moveaxis(preco, i, 0).reshape(len(axes[i]), -1), (5, 50, 95), axis=1)
+            sensibilidade[field] = [
+                {"valor": v, **{f"p{q}": (None if np.isnan(x) else round(float(x), 2)) for q, x in zip((5, 50, 95), col)}}
+                for v, col in zip(faixas[field], rows.T)
+            ]
+
+    result = {
+        "ok": True,
+        "modo": "monte_carlo" if amostras > 0 else "grade",
+        "cenarios": total,
+        "validos": validos,
+        "faixas": faixas,
+        "preco_min_sessao": _bands(preco.ravel()),
+        "receita_por_hora_bruta": _bands(por_hora.ravel()),
+        "sensibilidade": sensibilidade,
+    }
+    if amostras > 0:
+        sorteadas = axes[SWEEP_FIELDS.index("faltas_perc")] * 100.0
+        result["faltas_sorteadas"] = {f"p{q}": round(float(v), 1)
+                                      for q, v in zip((5, 50, 95), np.percentile(sorteadas, (5, 50, 95)))}
+    result["ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
 def gerar_politica(data: dict) -> dict:
     tipo = data.get("tipo", "faltas")
     modalidade = data.get("modalidade", "Online")
@@ -775,8 +2642,68 @@ def _sanitize_filename(name: str) -> str:
     cleaned = "".join([c if c in keep else "_" for c in (name or "")]).strip()
     return cleaned[:80] if cleaned else "documento"
 
-def _make_docx_bytes(title: str, text: str) -> BytesIO:
-    doc = Document()
+DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# O template padrão do python-docx é lido e parseado uma vez por worker; cada
+# documento novo parte de uma cópia (deepcopy é mais barato que reabrir o zip).
+_docx_template = {"doc": None}
+_docx_template_lock = threading.Lock()
+
+def _new_docx():
+    if _docx_template["doc"] is None:
+        with _docx_template_lock:
+            if _docx_template["doc"] is None:
+                from docx import Document  # python-docx só carrega quando o primeiro .docx é gerado
+                _docx_template["doc"] = Document()
+    return copy.deepcopy(_docx_template["doc"])
+
+class _BytesLRU:
+    """LRU de bytes limitado pelo tamanho total (não pelo número de itens)."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"items": len(self._items), "bytes": self._size, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+_docx_cache = _BytesLRU(DOCX_CACHE_MAX_BYTES)
+
+def _docx_key(title: str, text: str) -> str:
+    return hashlib.sha256(f"{title}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+@timed("docx")
+def _render_docx(title: str, text: str) -> bytes:
+    doc = _new_docx()
     if title:
         doc.add_heading(title, level=1)
 
@@ -786,8 +2713,23 @@ def _make_docx_bytes(title: str, text: str) -> BytesIO:
 
     bio = BytesIO()
     doc.save(bio)
-    bio.seek(0)
-    return bio
+    return bio.getvalue()
+
+def docx_bytes(title: str, text: str) -> tuple[bytes, str]:
+    """(conteúdo .docx, etag), servindo do LRU quando (title, text) já foi gerado."""
+    key = _docx_key(title, text)
+    data = _docx_cache.get(key)
+    if data is None:
+        data = _render_docx(title, text)
+        _docx_cache.put(key, data)
+    return data, key
+
+def _make_docx_bytes(title: str, text: str) -> BytesIO:
+    data, _ = docx_bytes(title, text)
+    return BytesIO(data)
+
+def docx_cache_stats() -> dict:
+    return _docx_cache.stats()
 
 @app.route("/download-docx", methods=["POST"])
 def download_docx():
@@ -799,14 +2741,458 @@ def download_docx():
         flash("Nada para baixar. Gere o documento primeiro.", "success")
         return redirect(request.referrer or url_for("home"))
 
-    bio = _make_docx_bytes(title=title, text=text)
-    return send_file(
-        bio,
-        as_attachment=True,
-        download_name=f"{filename}.docx",
-        mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    data, etag = docx_bytes(title=title, text=text)
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+    else:
+        resp = send_file(
+            BytesIO(data),
+            as_attachment=True,
+            download_name=f"{filename}.docx",
+            mimetype=DOCX_MIMETYPE,
+        )
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+# =====================================================
+# EXPORTAÇÃO EM LOTE (ZIP)
+# =====================================================
+# Kit completo em um request: contrato, as 5 políticas e os roteiros de rede.
+# Os .docx são gerados em paralelo (pool de threads) e o zip é escrito direto
+# na resposta, um arquivo por vez, sem montar o zip inteiro na memória.
+_POLITICA_TIPOS = ("faltas", "mensagens", "reembolso", "online", "sigilo")
+_REDE_DESTINOS = ("psiquiatria", "autorizacao")
+EXPORT_DOCUMENTS = (
+    ["contrato"]
+    + [f"politica:{t}" for t in _POLITICA_TIPOS]
+    + [f"rede:{d}" for d in _REDE_DESTINOS]
+)
+
+_export_pool = {"pid": None, "pool": None}
+
+def _export_executor() -> ThreadPoolExecutor:
+    if _export_pool["pid"] != os.getpid():
+        _export_pool.update(pid=os.getpid(), pool=ThreadPoolExecutor(EXPORT_MAX_WORKERS, thread_name_prefix="export"))
+    return _export_pool["pool"]
+
+def render_export_document(kind: str, data: dict) -> tuple[str, str, str]:
+    """(nome do arquivo, título, texto) de um item de EXPORT_DOCUMENTS."""
+    if kind == "contrato":
+        return "contrato-terapeutico", "Contrato Terapêutico", gerar_contrato_texto(data)
+    group, _, sub = kind.partition(":")
+    if group == "politica" and sub in _POLITICA_TIPOS:
+        # O formulário do contrato chama o prazo de "prazo_cancel".
+        out = gerar_politica({"prazo": data.get("prazo_cancel", "24"), **data, "tipo": sub})
+        return f"politica-{sub}", out["titulo"], out["texto"]
+    if group == "rede" and sub in _REDE_DESTINOS:
+        out = gerar_rede({**data, "destino": sub})
+        return f"rede-{sub}", out["titulo"], out["texto"]
+    raise ValueError(f"documento desconhecido: {kind}")
+
+class _ZipStream:
+    """Destino não-seekable para o ZipFile: acumula bytes até serem drenados."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def write(self, b) -> int:
+        self._buf += b
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+def _render_export_docx(doc: tuple[str, str, str]) -> tuple[str, bytes]:
+    filename, title, text = doc
+    content, _ = docx_bytes(title, text)
+    return f"{filename}.docx", content
+
+def iter_export_zip(docs: list[tuple[str, str, str]]):
+    """Gera o .zip em pedaços; os .docx são montados em paralelo.
+
+    `docs` vem de render_export_document: o texto já foi validado antes da
+    resposta começar, então um erro de entrada não vira um zip truncado.
+    """
+    stream = _ZipStream()
+    results = _export_executor().map(_render_export_docx, docs)
+    # .docx já é um zip: ZIP_STORED evita recomprimir.
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as zf:
+        for name, content in results:
+            zf.writestr(name, content)
+            yield stream.drain()
+    yield stream.drain()
+
+@app.route("/export-zip", methods=["POST"])
+def export_zip():
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({"ok": False, "error": "corpo deve ser um objeto JSON"}), 400
+        data = payload.get("data") or {}
+        kinds = payload.get("documents") or EXPORT_DOCUMENTS
+    else:
+        data = request.form.to_dict()
+        kinds = request.form.getlist("documents") or EXPORT_DOCUMENTS
+    if not isinstance(data, dict) or not isinstance(kinds, (list, tuple)) \
+            or not all(isinstance(k, str) for k in kinds):
+        return jsonify({"ok": False, "error": "data deve ser objeto e documents, lista de nomes"}), 400
+    kinds = list(dict.fromkeys(kinds))
+    unknown = [k for k in kinds if k not in EXPORT_DOCUMENTS]
+    if unknown:
+        return jsonify({"ok": False, "error": "documentos desconhecidos", "documents": unknown}), 400
+
+    # Os geradores esperam texto (como no formulário).
+    data = {str(k): str(v) for k, v in data.items() if v is not None}
+    try:
+        docs = [render_export_document(k, data) for k in kinds]
+    except Exception as e:
+        app.logger.warning("Exportação inválida: %s", e)
+        return jsonify({"ok": False, "error": "dados inválidos para gerar os documentos"}), 400
+
+    return Response(
+        iter_export_zip(docs),
+        mimetype="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="kit-consultorio.zip"'},
     )
 
+# =====================================================
+# API v1 (LOTE, NDJSON)
+# =====================================================
+# POST /api/v1/<ferramenta> com uma lista de entradas (ou {"items": [...],
+# "defaults": {...}}). A resposta sai item a item, uma linha JSON por entrada,
+# na mesma ordem: {"index", "ok", "result"} ou {"index", "ok": false, "error"}.
+# Um item inválido não derruba o lote.
+def _api_texto(data: dict) -> dict:
+    """Campos como o formulário os enviaria: números viram texto; objeto/lista é erro de entrada."""
+    out = {}
+    for key, value in data.items():
+        if isinstance(value, (dict, list)):
+            raise ValueError(f"campo {key!r} deve ser texto ou número")
+        if value is not None:
+            out[key] = str(value)
+    return out
+
+def _api_contrato(data: dict) -> dict:
+    return {"titulo": "Contrato Terapêutico", "texto": gerar_contrato_texto(_api_texto(data))}
+
+def _api_politicas(data: dict) -> dict:
+    return gerar_politica(_api_texto(data))
+
+def _api_rede(data: dict) -> dict:
+    return gerar_rede(_api_texto(data))
+
+def _api_honorarios(data: dict) -> dict:
+    out = calc_honorarios(data)
+    if not out.pop("ok"):
+        raise ValueError(out["erro"])
+    return out
+
+def _api_cenarios(data: dict) -> dict:
+    out = calc_honorarios_cenarios(data)
+    if not out.pop("ok"):
+        raise ValueError(out["erro"])
+    return out
+
+API_TOOLS = {
+    "contrato": _api_contrato,
+    "honorarios": _api_honorarios,
+    "honorarios-cenarios": _api_cenarios,
+    "politicas": _api_politicas,
+    "rede": _api_rede,
+}
+
+def iter_api_batch(tool, items: list, defaults: dict):
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            line = {"index": i, "ok": False, "error": "cada item deve ser um objeto"}
+        else:
+            try:
+                line = {"index": i, "ok": True, "result": tool({**defaults, **item})}
+            except (TypeError, ValueError) as e:
+                line = {"index": i, "ok": False, "error": str(e) or e.__class__.__name__}
+            except Exception:
+                app.logger.exception("API: item %d falhou", i)
+                line = {"index": i, "ok": False, "error": "erro interno"}
+        yield json.dumps(line, ensure_ascii=False) + "\n"
+
+@app.route("/api/v1/<tool>", methods=["POST"])
+def api_batch(tool):
+    fn = API_TOOLS.get(tool)
+    if fn is None:
+        return jsonify({"ok": False, "error": "ferramenta desconhecida", "tools": list(API_TOOLS)}), 404
+    payload = request.get_json(silent=True)
+    defaults = {}
+    if isinstance(payload, dict):
+        defaults = payload.get("defaults") or {}
+        payload = payload.get("items")
+    if not isinstance(payload, list) or not isinstance(defaults, dict):
+        return jsonify({"ok": False, "error": "envie uma lista JSON de entradas (ou {items, defaults})"}), 400
+    if len(payload) > API_MAX_ITEMS:
+        return jsonify({"ok": False, "error": f"máximo de {API_MAX_ITEMS} itens por requisição"}), 413
+    return Response(iter_api_batch(fn, payload, defaults), mimetype="application/x-ndjson")
+
+# =====================================================
+# TAREFAS PERIÓDICAS (MANUTENÇÃO)
+# =====================================================
+# Uma thread por processo executa as tarefas vencidas. As tarefas precisam ser
+# idempotentes, porque cada worker do gunicorn tem a sua própria thread.
+_periodic_jobs = []  # [{"name", "interval", "fn", "next_run"}]
+_periodic_state = {"pid": None}
+_periodic_lock = threading.Lock()
+
+def periodic_job(name: str, interval_seconds: float):
+    def deco(fn):
+        _periodic_jobs.append({"name": name, "interval": interval_seconds, "fn": fn,
+                               "next_run": time.monotonic() + interval_seconds})
+        return fn
+    return deco
+
+def _periodic_loop():
+    while True:
+        now = time.monotonic()
+        for job in _periodic_jobs:
+            if job["interval"] > 0 and now >= job["next_run"]:
+                job["next_run"] = now + job["interval"]
+                try:
+                    job["fn"]()
+                except Exception:
+                    app.logger.exception("Tarefa periódica %s falhou", job["name"])
+        time.sleep(1.0)
+
+@app.before_request
+def _ensure_periodic_thread():
+    if _periodic_state["pid"] == os.getpid():
+        return
+    with _periodic_lock:
+        if _periodic_state["pid"] != os.getpid():
+            _periodic_state["pid"] = os.getpid()
+            threading.Thread(target=_periodic_loop, name="periodic-jobs", daemon=True).start()
+
+@periodic_job("history_retention", MAINTENANCE_INTERVAL_SECONDS if HISTORY_RETENTION_DAYS > 0 else 0)
+def _history_retention_job():
+    result = run_history_retention()
+    if result["removed"]:
+        app.logger.info("Retenção do histórico: %s", result)
+
+@periodic_job("tfidf_refresh", TFIDF_REFRESH_SECONDS if np is not None else 0)
+def _tfidf_refresh_job():
+    # Pega chunks gravados por outro processo (ex.: ingestão pela linha de comando).
+    manifest = _tfidf_manifest()
+    conn = db()
+    gen = active_generation()
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM chunks WHERE generation = ?", (gen,)).fetchone()[0]
+    current = (manifest["max_chunk_id"], manifest.get("removed"), manifest.get("generation")) if manifest else None
+    if current != (max_id, _chunks_removed(conn), gen):
+        update_tfidf_index()
+
+@periodic_job("question_rollup", MAINTENANCE_INTERVAL_SECONDS)
+def _question_rollup_job():
+    rollup_question_stats()
+
+@periodic_job("suggest_weights", SUGGEST_REFRESH_SECONDS)
+def _suggest_weights_job():
+    refresh_suggestions()
+
+@periodic_job("official_sources", FETCH_INTERVAL_SECONDS)
+def _official_sources_job():
+    # O cache em disco é compartilhado: o primeiro worker a rodar faz os
+    # requests, os demais encontram as páginas "fresh" e não saem para a rede.
+    results = refresh_official_sources()
+    _set_meta_json("last_fetch", {"finished": datetime.now().isoformat(timespec="seconds"), "results": results})
+
+@app.cli.command("fetch-sources")
+@click.option("--force", is_flag=True, help="Ignora o cache e reindexa tudo.")
+def fetch_sources_command(force):
+    """Baixa e indexa as páginas/PDFs de LINKS_OFICIAIS."""
+    init_db()
+    for item in refresh_official_sources(force=force):
+        print(item)
+    update_tfidf_index()
+
+@app.cli.command("ingest-pdf")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--title", default=None, help="Título do documento (padrão: nome do arquivo).")
+def ingest_pdf_command(path, title):
+    """Indexa um PDF (ex.: resolução do CFP) na base de busca."""
+    init_db()
+    print(ingest_pdf(path, title))
+    # Garante o índice TF-IDF atualizado antes do processo terminar.
+    update_tfidf_index()
+
+@app.cli.command("retention")
+def retention_command():
+    """Aplica agora a política de retenção do histórico."""
+    init_db()
+    print(run_history_retention())
+
+# =====================================================
+# CACHE HTTP
+# =====================================================
+# Páginas que só mudam com deploy (GET de /recursos e dos formulários) são
+# renderizadas uma vez por worker. O ETag leva o BUILD_HASH (código + templates
+# + static), então um deploy invalida tudo sem precisar limpar nada.
+def _build_hash() -> str:
+    h = hashlib.sha256()
+    root = os.path.dirname(os.path.abspath(__file__))
+    paths = [os.path.join(root, "app.py")]
+    for sub in ("templates", "static"):
+        for dirpath, _, files in sorted(os.walk(os.path.join(root, sub))):
+            paths += [os.path.join(dirpath, f) for f in sorted(files)]
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                h.update(f.read())
+        except OSError:
+            pass
+    return h.hexdigest()[:16]
+
+BUILD_HASH = _build_hash()
+
+_page_cache = {}
+
+def render_cached_page(template: str, **context):
+    """render_template com cache do HTML, ETag forte, Cache-Control e 304."""
+    if session.get("_flashes"):
+        # Mensagem flash é por usuário: renderiza na hora e não deixa cachear.
+        resp = app.make_response(render_template(template, **context))
+        resp.headers["Cache-Control"] = "no-store"
+        return resp
+
+    key = (template, request.path)
+    entry = _page_cache.get(key)
+    if entry is None:
+        body = render_template(template, **context).encode("utf-8")
+        entry = _page_cache[key] = (body, f"{BUILD_HASH}-{hashlib.sha256(body).hexdigest()[:16]}")
+    resp = app.response_class(entry[0], mimetype="text/html")
+    resp.set_etag(entry[1])
+    resp.headers["Cache-Control"] = f"public, max-age={PAGE_MAX_AGE}"
+    return resp.make_conditional(request)
+
+def cacheable_json(payload: dict, max_age: int):
+    """JSON com ETag derivado do conteúdo; If-None-Match igual vira 304."""
+    resp = jsonify(payload)
+    resp.add_etag()
+    resp.headers["Cache-Control"] = f"public, max-age={max_age}"
+    return resp.make_conditional(request)
+
+# =====================================================
+# COMPRESSÃO E ARQUIVOS ESTÁTICOS
+# =====================================================
+# Respostas texto/JSON acima de COMPRESS_MIN_BYTES saem em br (se o brotli
+# estiver instalado) ou gzip, conforme o Accept-Encoding. Respostas com ETag
+# (páginas em cache, /qa) têm a versão comprimida guardada por ETag, e o ETag
+# vira fraco (W/) porque os bytes mudam com a codificação. Respostas em
+# streaming (zip, NDJSON) não passam por aqui.
+_COMPRESSIBLE = {"text/html", "text/css", "text/plain", "text/csv", "application/json",
+                 "application/javascript", "text/javascript", "image/svg+xml"}
+_compressed_cache = _BytesLRU(8 * 1024 * 1024)
+
+def _compress(data: bytes, encoding: str, level: int = COMPRESS_LEVEL) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=min(11, level + 2 if level < 9 else 11))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def _pick_encoding(available=("br", "gzip")) -> str | None:
+    accept = request.accept_encodings
+    for encoding in available:
+        if (encoding != "br" or brotli is not None) and accept.quality(encoding) > 0:
+            return encoding
+    return None
+
+@app.after_request
+def _compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 206, 304) or "Content-Encoding" in response.headers
+            or response.mimetype not in _COMPRESSIBLE):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = _pick_encoding()
+    if encoding is None:
+        return response
+    etag, weak = response.get_etag()
+    key = f"{etag}:{encoding}" if etag and not weak else None
+    body = _compressed_cache.get(key) if key else None
+    if body is None:
+        body = _compress(data, encoding)
+        if key:
+            _compressed_cache.put(key, body)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+# Estáticos: cada arquivo ganha um nome com hash do conteúdo (style.<hash>.css),
+# servido com Cache-Control immutable; os compressíveis já ficam prontos em
+# gzip/br na memória. A tabela é montada no import (mudou o arquivo, reinicie).
+_static_files = {}    # nome real -> {"fingerprint", "etag", "mimetype", "variants": {encoding: bytes}}
+_static_reverse = {}  # nome com hash -> nome real
+
+def _build_static_table():
+    root = app.static_folder
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, root).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            stem, ext = os.path.splitext(rel)
+            mimetype = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+            variants = {}
+            if mimetype in _COMPRESSIBLE and len(data) >= COMPRESS_MIN_BYTES:
+                variants = {"identity": data, "gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+                if brotli is not None:
+                    variants["br"] = brotli.compress(data, quality=11)
+            fingerprint = f"{stem}.{digest}{ext}"
+            _static_files[rel] = {"fingerprint": fingerprint, "etag": digest, "mimetype": mimetype,
+                                  "variants": variants}
+            _static_reverse[fingerprint] = rel
+
+_build_static_table()
+
+@app.url_defaults
+def _static_fingerprint(endpoint, values):
+    # url_for('static', filename='style.css') -> /static/style.<hash>.css
+    if endpoint == "static" and values.get("filename") in _static_files:
+        values["filename"] = _static_files[values["filename"]]["fingerprint"]
+
+@app.url_value_preprocessor
+def _static_unfingerprint(endpoint, values):
+    if endpoint == "static" and values and values.get("filename") in _static_reverse:
+        values["filename"] = _static_reverse[values["filename"]]
+        g.static_immutable = True
+
+def _static_view(filename):
+    entry = _static_files.get(filename)
+    if entry is None or not entry["variants"]:
+        resp = app.send_static_file(filename)
+    else:
+        encoding = _pick_encoding(tuple(e for e in ("br", "gzip") if e in entry["variants"])) or "identity"
+        resp = app.response_class(entry["variants"][encoding], mimetype=entry["mimetype"])
+        resp.vary.add("Accept-Encoding")
+        if encoding != "identity":
+            resp.headers["Content-Encoding"] = encoding
+        resp.set_etag(entry["etag"], weak=encoding != "identity")
+        resp = resp.make_conditional(request)
+    if g.get("static_immutable"):
+        resp.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+    else:
+        # Nome sem hash (link antigo ou externo): sempre revalida pelo ETag.
+        resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+app.view_functions["static"] = _static_view
+
 # =====================================================
 # ROTAS
 # =====================================================
@@ -816,25 +3202,34 @@ def home():
 
     if request.method == "POST":
         if "load_bases" in request.form:
-            clear_documents()
-            index_content("Código de Ética (Resumo)", TEXTO_CODIGO_ETICA)
-            flash("Base atualizada com sucesso!", "success")
+            if start_reindex():
+                flash("Atualização da base iniciada. Acompanhe o progresso no Admin.", "success")
+            else:
+                flash("Já existe uma atualização da base em andamento.", "success")
             return redirect(url_for("home"))
 
         q = (request.form.get("q") or "").strip()
+        if len(q) > QUESTION_MAX_CHARS:
+            flash(f"Pergunta muito longa (máximo de {QUESTION_MAX_CHARS} caracteres).", "success")
+            return redirect(url_for("home"))
         if q:
             answer = generate_answer_for_question(q)
             save_history(q, answer)
 
     all_questions = [{"text": q} for q in QUICK_QUESTIONS]
+    history_page = get_history_page(limit=HISTORY_PAGE_SIZE)
+    since = (datetime.now() - timedelta(days=TOP_QUESTIONS_HOME_DAYS)).strftime("%Y-%m-%d")
 
     return render_template(
         "home.html",
         app_name=APP_NAME,
         stats=stats(),
-        history=get_history(50),
+        history=history_page["items"],
+        history_cursor=history_page["next_cursor"],
         answer=answer,
         questions=all_questions,
+        top_questions=top_questions(start=since, limit=5),
+        top_days=TOP_QUESTIONS_HOME_DAYS,
     )
 
 # Rota opcional: para o front abrir modal via fetch (sem rolar)
@@ -843,52 +3238,271 @@ def qa_get():
     q = (request.args.get("q") or "").strip()
     if not q:
         return jsonify({"ok": False, "error": "missing q"}), 400
-    html = generate_answer_for_question(q)
+    if len(q) > QUESTION_MAX_CHARS:
+        return jsonify({"ok": False, "error": f"q maior que {QUESTION_MAX_CHARS} caracteres"}), 400
+    html, matched, score = answer_question(q)
+    # Pergunta fora do banco de respostas: sugere trechos do Código.
+    passages = []
+    if matched not in RESPOSTAS_DB:
+        passages = [{"text": p["chunk_text"], "score": p["score"]} for p in semantic_search(q, k=3)]
     # não salva no histórico aqui, porque só “abrir” não significa que perguntou;
     # o template pode optar por chamar /qa e também postar o form se quiser.
-    return jsonify({"ok": True, "question": q, "answer_html": html})
+    # A resposta só depende de q (e do corpus): proxies/CDN podem guardar.
+    return cacheable_json({"ok": True, "question": q, "answer_html": html, "matched": matched, "score": score,
+                           "passages": passages}, QA_MAX_AGE)
+
+# Type-ahead do campo de pergunta da home (chamado com debounce pelo front).
+@app.route("/suggest", methods=["GET"])
+def suggest_get():
+    prefix = (request.args.get("prefix") or "").strip()[:QUESTION_MAX_CHARS]
+    try:
+        k = min(max(int(request.args.get("k", "8")), 1), SUGGEST_MAX_K)
+    except ValueError:
+        k = 8
+    items = [{"text": text, "answered": text in RESPOSTAS_DB} for text in suggest(prefix, k)] if prefix else []
+    return cacheable_json({"ok": True, "prefix": prefix, "suggestions": items}, QA_MAX_AGE)
+
+@app.route("/history", methods=["GET"])
+def history_api():
+    cursor = request.args.get("cursor", type=int)
+    limit = min(max(request.args.get("limit", HISTORY_PAGE_SIZE, type=int), 1), 100)
+    page = get_history_page(before_id=cursor, limit=limit, with_answers=request.args.get("answers") == "1")
+    return jsonify({"ok": True, **page})
 
 @app.route("/recursos")
 def recursos():
-    return render_template("resources.html", app_name=APP_NAME, links=LINKS_OFICIAIS)
+    return render_cached_page("resources.html", app_name=APP_NAME, links=LINKS_OFICIAIS)
 
 @app.route("/contrato", methods=["GET", "POST"])
 def contrato():
-    contrato_txt = None
-    if request.method == "POST":
-        contrato_txt = gerar_contrato_texto(request.form)
+    if request.method == "GET":
+        return render_cached_page("contrato.html", app_name=APP_NAME, contrato_txt=None)
+    contrato_txt = gerar_contrato_texto(request.form)
     return render_template("contrato.html", app_name=APP_NAME, contrato_txt=contrato_txt)
 
 @app.route("/honorarios", methods=["GET", "POST"])
 def honorarios():
-    resultado = None
-    if request.method == "POST":
-        resultado = calc_honorarios(request.form)
+    if request.method == "GET":
+        return render_cached_page("honorarios.html", app_name=APP_NAME, resultado=None, links=LINKS_OFICIAIS)
+    resultado = calc_honorarios(request.form)
     return render_template("honorarios.html", app_name=APP_NAME, resultado=resultado, links=LINKS_OFICIAIS)
 
+# Cenários da calculadora (JSON ou formulário) -> JSON com faixas e sensibilidade.
+@app.route("/honorarios/cenarios", methods=["POST"])
+def honorarios_cenarios():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = request.form
+    out = calc_honorarios_cenarios(data)
+    return jsonify(out), (200 if out["ok"] else 400)
+
 @app.route("/politicas", methods=["GET", "POST"])
 def politicas():
-    out = None
-    if request.method == "POST":
-        out = gerar_politica(request.form)
+    if request.method == "GET":
+        return render_cached_page("politicas.html", app_name=APP_NAME, out=None)
+    out = gerar_politica(request.form)
     return render_template("politicas.html", app_name=APP_NAME, out=out)
 
 @app.route("/rede", methods=["GET", "POST"])
 def rede():
-    out = None
-    if request.method == "POST":
-        out = gerar_rede(request.form)
+    if request.method == "GET":
+        return render_cached_page("rede.html", app_name=APP_NAME, out=None)
+    out = gerar_rede(request.form)
     return render_template("rede.html", app_name=APP_NAME, out=out)
 
+# Períodos do filtro "mais perguntadas" no admin (dias; None = tudo).
+ADMIN_TOP_RANGES = {"7": 7, "30": 30, "90": 90, "365": 365, "tudo": None}
+
+def _admin_range() -> dict:
+    """Lê ?periodo= ou ?desde=&ate= (YYYY-MM-DD) da query string."""
+    desde = (request.args.get("desde") or "").strip()
+    ate = (request.args.get("ate") or "").strip()
+    for value in (desde, ate):
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                desde = ate = ""
+    periodo = request.args.get("periodo", "30")
+    if not (desde or ate):
+        days = ADMIN_TOP_RANGES.get(periodo, 30)
+        if days is not None:
+            desde = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    else:
+        periodo = ""
+    return {"periodo": periodo, "desde": desde, "ate": ate}
+
 @app.route("/admin")
 def admin():
-    return render_template("admin.html", stats=stats(), app_name=APP_NAME)
+    rng = _admin_range()
+    return render_template(
+        "admin.html",
+        top=top_questions(rng["desde"] or None, rng["ate"] or None, limit=20),
+        trend=question_trend(rng["desde"] or None, rng["ate"] or None),
+        top_range=rng,
+        top_ranges=list(ADMIN_TOP_RANGES),
+        perf=metrics_summary(collect_metrics()),
+        stats=stats(),
+        db_stats=db_stats(),
+        writer_stats=history_writer_stats(),
+        reindex=reindex_progress(),
+        ingest=last_ingest(),
+        fetch=last_fetch(),
+        app_name=APP_NAME,
+    )
+
+@app.route("/admin/fetch-sources", methods=["POST"])
+def admin_fetch_sources():
+    start_sources_refresh(force="force" in request.form)
+    flash("Coleta das fontes oficiais iniciada em segundo plano.", "success")
+    return redirect(url_for("admin"))
+
+@app.route("/admin/upload-pdf", methods=["POST"])
+def admin_upload_pdf():
+    f = request.files.get("pdf")
+    if not f or not f.filename:
+        flash("Escolha um arquivo PDF.", "success")
+        return redirect(url_for("admin"))
+    if not f.filename.lower().endswith(".pdf"):
+        flash("O arquivo precisa ser um PDF.", "success")
+        return redirect(url_for("admin"))
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    title = (request.form.get("title") or "").strip() or os.path.splitext(f.filename)[0]
+    # Nome único: dois uploads com o mesmo nome não se sobrescrevem durante a ingestão.
+    fd, path = tempfile.mkstemp(dir=UPLOAD_DIR, prefix=_sanitize_filename(os.path.splitext(f.filename)[0]) + "-",
+                                suffix=".pdf")
+    os.close(fd)
+    f.save(path)
+    start_pdf_ingest(path, title)
+    flash(f"PDF recebido. Indexando “{title}” em segundo plano.", "success")
+    return redirect(url_for("admin"))
+
+@app.errorhandler(413)
+def request_too_large(e):
+    if request.endpoint == "admin_upload_pdf":
+        flash(f"PDF grande demais (máximo de {UPLOAD_MAX_BYTES // (1024 * 1024)} MB).", "success")
+        return redirect(url_for("admin"))
+    return e
+
+# Histórico completo para análise: ?formato=csv|ndjson&desde=&ate=&respostas=1
+@app.route("/admin/history-export")
+def admin_history_export():
+    fmt = request.args.get("formato", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"ok": False, "error": "formato deve ser csv ou ndjson"}), 400
+    desde = (request.args.get("desde") or "").strip() or None
+    ate = (request.args.get("ate") or "").strip() or None
+    for value in (desde, ate):
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                return jsonify({"ok": False, "error": "datas no formato AAAA-MM-DD"}), 400
+    name = f"historico-{datetime.now():%Y%m%d}.{fmt}"
+    return Response(
+        iter_history_export(fmt, desde, ate, with_answers=request.args.get("respostas") == "1"),
+        mimetype="text/csv" if fmt == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{name}"', "Cache-Control": "no-store"},
+    )
+
+# Mesmos números do /admin, em JSON, para monitoramento.
+@app.route("/admin/stats.json")
+def admin_stats_json():
+    return jsonify({
+        "stats": stats(),
+        "db": db_stats(),
+        "history_writer": history_writer_stats(),
+        "reindex": reindex_progress(),
+        "docx_cache": docx_cache_stats(),
+        "top_questions": top_questions(_admin_range()["desde"] or None, _admin_range()["ate"] or None),
+    })
 
 # =====================================================
 # INICIALIZAÇÃO
 # =====================================================
+# Importar o módulo não toca no banco. create_app() faz as migrações, o conteúdo
+# inicial e o aquecimento dos caches uma única vez por processo. No gunicorn, o
+# hook on_starting do gunicorn.conf.py chama create_app() no master antes do fork
+# (com ou sem app na linha de comando), e os workers já nascem prontos,
+# compartilhando essas páginas por copy-on-write. Sem esse hook (flask run,
+# gunicorn sem o config) o primeiro request, ou o primeiro /ready, faz o boot.
+_boot = {"ready": False, "pid": None, "boot_seconds": None, "worker_boot_seconds": None, "steps": {}}
+_boot_lock = threading.Lock()
+
+def _wait_tfidf_threads():
+    # Não deixa uma atualização do índice em andamento atravessar um fork.
+    for t in threading.enumerate():
+        if t.name == "tfidf-update":
+            t.join()
+
+def warmup() -> dict:
+    """Carrega o que todo worker acabaria carregando no primeiro request; devolve ms por etapa."""
+    steps = {}
+
+    def step(name, fn):
+        t0 = time.perf_counter()
+        fn()
+        steps[name] = round((time.perf_counter() - t0) * 1000, 1)
+
+    step("suggest_trie", refresh_suggestions)
+    step("docx_template", _new_docx)
+    step("tfidf_index", _tfidf_load)
+    return steps
+
+def create_app() -> Flask:
+    """Migra o banco, indexa o texto base se o corpus estiver vazio e aquece os caches. Idempotente."""
+    if _boot["ready"]:
+        return app
+    with _boot_lock:
+        if _boot["ready"]:
+            return app
+        t0 = time.perf_counter()
+        steps = {}
+        init_db()
+        steps["init_db"] = round((time.perf_counter() - t0) * 1000, 1)
+        if stats()["chunks"] == 0:
+            index_content("Código de Ética (Resumo)", TEXTO_CODIGO_ETICA)
+            update_tfidf_index()
+        _wait_tfidf_threads()
+        steps.update(warmup())
+        # A conexão SQLite não pode ser herdada por um fork: cada worker abre a sua.
+        close_db()
+        # Objetos criados até aqui ficam fora da coleta cíclica: o GC não reescreve
+        # as páginas herdadas do master (que continuam compartilhadas entre workers).
+        gc.freeze()
+        _boot.update(ready=True, pid=os.getpid(), boot_seconds=round(time.perf_counter() - t0, 3), steps=steps)
+        app.logger.info("Boot em %.3fs (import %.3fs): %s", _boot["boot_seconds"], IMPORT_SECONDS, steps)
+    return app
+
+@app.before_request
+def _ensure_booted():
+    if not _boot["ready"] and request.endpoint != "ready":
+        create_app()
+
+@app.route("/ready")
+def ready():
+    """Readiness: faz o boot se ainda não houve; 200 com ele pronto, 503 se falhou."""
+    if not _boot["ready"]:
+        try:
+            create_app()
+        except Exception:
+            app.logger.exception("Boot falhou")
+    payload = {
+        "ready": _boot["ready"],
+        "pid": os.getpid(),
+        "booted_in_pid": _boot["pid"],
+        "import_seconds": round(IMPORT_SECONDS, 3),
+        "boot_seconds": _boot["boot_seconds"],
+        "worker_boot_seconds": _boot["worker_boot_seconds"],
+        "steps_ms": _boot["steps"],
+    }
+    resp = jsonify(payload)
+    resp.status_code = 200 if _boot["ready"] else 503
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
 if __name__ == "__main__":
-    init_db()
-    if stats()["chunks"] == 0:
-        index_content("Código de Ética (Resumo)", TEXTO_CODIGO_ETICA)
-    app.run(debug=True, port=5000)
+    create_app().run(debug=True, port=5000)
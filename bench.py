@@ -0,0 +1,339 @@
+"""Benchmark do EthosPsi: rotas pelo test client do Flask e por um gunicorn local.
+
+Uso:
+    python bench.py                                   # 10k linhas, só test client
+    python bench.py --history 1M --chunks 100k --gunicorn --workers 2
+    python bench.py --out bench.json --baseline bench-baseline.json
+
+Os dados sintéticos (qa_history e chunks, de 1k a 10M linhas) ficam em um
+diretório de trabalho próprio, nunca em ./data. Para cada rota são medidos
+vazão, latência p50/p95/p99 e o RSS do processo (ou de cada worker, no
+gunicorn). O resultado sai em JSON; com --baseline, a p95 de cada rota é
+comparada com a do arquivo e o script sai com código 1 se alguma piorar além
+da tolerância.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def parse_count(value: str) -> int:
+    """ "10k" -> 10000, "2M" -> 2000000."""
+    value = value.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    return int(float(value[:-1] if mult > 1 else value) * mult)
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Percentil por posição mais próxima (valores já ordenados)."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+def summarize(latencies: list[float], wall: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "n": len(values),
+        "throughput_rps": round(len(values) / wall, 1) if wall > 0 else None,
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else None,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+    }
+
+def rss_mb(pid: int | str = "self") -> float | None:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def child_pids(pid: int) -> list[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+# -----------------------------------------------------
+# Dados sintéticos
+# -----------------------------------------------------
+def seed_data(app, n_history: int, n_chunks: int, rng: random.Random):
+    """Completa o banco do diretório de trabalho até n_history/n_chunks linhas."""
+    app.init_db()
+    have = app.stats()
+    if have["chunks"] == 0:
+        app.index_content("Código de Ética (Resumo)", app.TEXTO_CODIGO_ETICA)
+        have = app.stats()
+
+    lines = [l.strip() for l in app.TEXTO_CODIGO_ETICA.splitlines() if l.strip()]
+    missing = n_chunks - have["chunks"]
+    if missing > 0:
+        t0 = time.perf_counter()
+        per_doc = max(1_000, missing // 20)  # poucos documentos: poucas atualizações do TF-IDF
+        start, doc = have["chunks"], 0
+        while missing > 0:
+            size = min(per_doc, missing)
+            chunks = (f"{rng.choice(lines)} {rng.choice(lines)} (trecho sintético {start + i})" for i in range(size))
+            app.upsert_document(f"Sintético {start}-{doc}", chunks)
+            start, missing, doc = start + size, missing - size, doc + 1
+        print(f"  chunks: +{n_chunks - have['chunks']} em {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    missing = n_history - have["history"]
+    if missing > 0:
+        t0 = time.perf_counter()
+        questions = list(app.QUICK_QUESTIONS) + [f"Pergunta sintética {i}?" for i in range(5_000)]
+        answers = {}
+        now = datetime.now()
+        batch = []
+        for i in range(missing):
+            q = rng.choice(questions) if rng.random() < 0.5 else questions[i % len(questions)]
+            if q not in answers:
+                answers[q] = app.generate_answer_for_question(q)
+            created = now - timedelta(seconds=rng.randrange(365 * 86400))
+            batch.append((q, answers[q], created.isoformat(timespec="seconds")))
+            if len(batch) >= 10_000:
+                app._write_history_rows(batch)
+                batch = []
+        if batch:
+            app._write_history_rows(batch)
+        print(f"  qa_history: +{missing} em {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    # Índice TF-IDF pronto antes de medir o /qa (segura o mesmo lock das atualizações em fundo).
+    app.update_tfidf_index()
+    return app.stats()
+
+# -----------------------------------------------------
+# Cenários
+# -----------------------------------------------------
+def http_scenarios(questions: list[str]) -> dict:
+    """nome -> função(i) que devolve (método, caminho, dados do formulário)."""
+    return {
+        "GET /": lambda i: ("GET", "/", None),
+        "POST / (pergunta)": lambda i: ("POST", "/", {"q": questions[i % len(questions)]}),
+        "GET /qa": lambda i: ("GET", "/qa?q=" + questions[i % len(questions)].replace(" ", "+"), None),
+        "GET /qa (fora do banco)": lambda i: ("GET", f"/qa?q=prontuario+sigilo+caso+{i}", None),
+        "POST /download-docx": lambda i: ("POST", "/download-docx",
+                                          {"doc_title": "Contrato", "doc_text": f"Cláusula {i}\n" * 40}),
+        "GET /contrato": lambda i: ("GET", "/contrato", None),
+        "POST /contrato": lambda i: ("POST", "/contrato", {"modalidade": "Online", "duracao": "50"}),
+        "GET /honorarios": lambda i: ("GET", "/honorarios", None),
+        "POST /honorarios": lambda i: ("POST", "/honorarios",
+                                       {"custos_fixos": str(1000 + i % 50), "pro_labore": "5000", "sessoes_semana": "20"}),
+        "GET /politicas": lambda i: ("GET", "/politicas", None),
+        "POST /politicas": lambda i: ("POST", "/politicas", {"tipo": ["faltas", "sigilo", "online"][i % 3]}),
+        "GET /rede": lambda i: ("GET", "/rede", None),
+        "POST /rede": lambda i: ("POST", "/rede", {"destino": "psiquiatria"}),
+    }
+
+def run_client(app, n: int, warmup: int, questions: list[str]) -> dict:
+    client = app.app.test_client()
+    results = {}
+    for name, make in http_scenarios(questions).items():
+        for i in range(warmup):
+            method, path, data = make(i)
+            client.open(path, method=method, data=data)
+        latencies = []
+        wall0 = time.perf_counter()
+        for i in range(n):
+            method, path, data = make(warmup + i)
+            t0 = time.perf_counter()
+            resp = client.open(path, method=method, data=data)
+            resp.get_data()  # consome respostas em streaming
+            latencies.append(time.perf_counter() - t0)
+            if resp.status_code >= 400:
+                raise SystemExit(f"{name}: status {resp.status_code}")
+        results[name] = summarize(latencies, time.perf_counter() - wall0)
+
+    # Funções de busca chamadas direto, sem HTTP.
+    for name, fn in (("simple_search", app.simple_search), ("semantic_search", app.semantic_search)):
+        with app.app.test_request_context():
+            latencies = []
+            wall0 = time.perf_counter()
+            for i in range(n):
+                t0 = time.perf_counter()
+                fn(questions[i % len(questions)])
+                latencies.append(time.perf_counter() - t0)
+            results[name] = summarize(latencies, time.perf_counter() - wall0)
+    return results
+
+def run_gunicorn(workdir: str, n: int, warmup: int, workers: int, concurrency: int, port: int,
+                 questions: list[str]) -> tuple[dict, dict]:
+    import requests
+
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    # Sem app posicional: vale o wsgi_app do gunicorn.conf.py (create_app()), como em produção.
+    cmd = [sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+           "-w", str(workers), "-b", f"127.0.0.1:{port}"]
+    log = open(os.path.join(workdir, "gunicorn.log"), "w")
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                if requests.get(base + "/", timeout=2).status_code == 200:
+                    break
+            except requests.ConnectionError:
+                pass
+            if proc.poll() is not None or time.monotonic() > deadline:
+                raise SystemExit(f"gunicorn não subiu; veja {log.name}")
+            time.sleep(0.2)
+
+        local = threading.local()  # uma Session (keep-alive) por thread cliente
+
+        def one(args):
+            method, path, data = args
+            s = getattr(local, "session", None)
+            if s is None:
+                s = local.session = requests.Session()
+            t0 = time.perf_counter()
+            r = s.request(method, base + path, data=data, timeout=60)
+            elapsed = time.perf_counter() - t0
+            if r.status_code >= 400:
+                raise RuntimeError(f"{method} {path}: status {r.status_code}")
+            return elapsed
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for name, make in http_scenarios(questions).items():
+                list(pool.map(one, [make(i) for i in range(warmup)]))
+                wall0 = time.perf_counter()
+                latencies = list(pool.map(one, [make(warmup + i) for i in range(n)]))
+                results[name] = summarize(latencies, time.perf_counter() - wall0)
+
+        rss = {"master": rss_mb(proc.pid), "workers": {str(p): rss_mb(p) for p in child_pids(proc.pid)}}
+        return results, rss
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        log.close()
+
+# -----------------------------------------------------
+# Comparação com o baseline
+# -----------------------------------------------------
+def compare(current: dict, baseline: dict, tolerance: float) -> list[dict]:
+    rows = []
+    for mode, scenarios in current["results"].items():
+        for name, r in scenarios.items():
+            b = baseline.get("results", {}).get(mode, {}).get(name)
+            if not b or not b.get("p95_ms"):
+                continue
+            ratio = r["p95_ms"] / b["p95_ms"]
+            rows.append({"mode": mode, "scenario": name, "baseline_p95_ms": b["p95_ms"],
+                         "p95_ms": r["p95_ms"], "ratio": round(ratio, 3), "regression": ratio > 1.0 + tolerance})
+    return rows
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--history", default="10k", help="linhas em qa_history (ex.: 1k, 100k, 10M)")
+    parser.add_argument("--chunks", default="10k", help="linhas em chunks (ex.: 1k, 100k, 10M)")
+    parser.add_argument("--requests", type=int, default=200, help="requests medidos por cenário")
+    parser.add_argument("--warmup", type=int, default=20, help="requests de aquecimento por cenário")
+    parser.add_argument("--gunicorn", action="store_true", help="também mede por um gunicorn local")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=4, help="clientes simultâneos no modo gunicorn")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--workdir", help="diretório dos dados sintéticos (reaproveitado entre execuções)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--baseline", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="piora de p95 aceita (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ethospsi-bench-")
+    keep = bool(args.workdir)
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    out_path = os.path.abspath(args.out)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    # DATA_DIR do app é relativo ao diretório atual: importa já dentro do workdir.
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    t0 = time.perf_counter()
+    import app
+    import_s = time.perf_counter() - t0
+
+    try:
+        print(f"Preparando dados em {workdir}", file=sys.stderr)
+        rng = random.Random(args.seed)
+        volumes = seed_data(app, parse_count(args.history), parse_count(args.chunks), rng)
+        questions = list(app.QUICK_QUESTIONS)
+
+        report = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "import_seconds": round(import_s, 3),
+                "volumes": volumes,
+                "args": vars(args),
+            },
+            "results": {},
+            "rss_mb": {},
+        }
+        print("Test client...", file=sys.stderr)
+        report["results"]["client"] = run_client(app, args.requests, args.warmup, questions)
+        report["rss_mb"]["client"] = {"current": rss_mb(),
+                                      "peak": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+        app._history_writer.stop()  # grava a fila do POST / antes de o gunicorn abrir o banco
+
+        if args.gunicorn:
+            print(f"gunicorn ({args.workers} workers, {args.concurrency} clientes)...", file=sys.stderr)
+            results, rss = run_gunicorn(workdir, args.requests, args.warmup, args.workers, args.concurrency,
+                                        args.port, questions)
+            report["results"]["gunicorn"] = results
+            report["rss_mb"]["gunicorn"] = rss
+
+        status = 0
+        if baseline_path:
+            with open(baseline_path, encoding="utf-8") as f:
+                rows = compare(report, json.load(f), args.tolerance)
+            report["comparison"] = rows
+            for r in rows:
+                flag = "PIOROU" if r["regression"] else "ok"
+                print(f"{flag:7} {r['mode']:9} {r['scenario']:28} p95 {r['baseline_p95_ms']:9.3f} -> "
+                      f"{r['p95_ms']:9.3f} ms (x{r['ratio']})", file=sys.stderr)
+            status = 1 if any(r["regression"] for r in rows) else 0
+
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        for mode, scenarios in report["results"].items():
+            for name, r in scenarios.items():
+                print(f"{mode:9} {name:28} {r['throughput_rps']:9} req/s  p50 {r['p50_ms']:8.3f}  "
+                      f"p95 {r['p95_ms']:8.3f}  p99 {r['p99_ms']:8.3f} ms", file=sys.stderr)
+        print(f"Resultado em {out_path}", file=sys.stderr)
+        return status
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    sys.exit(main())
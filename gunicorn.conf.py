@@ -0,0 +1,38 @@
+# Configuração do gunicorn: lida automaticamente quando está no diretório de trabalho.
+import os
+import shutil
+import time
+
+# App padrão quando a linha de comando não indica um. O boot (migrações,
+# conteúdo inicial, aquecimento) não depende disso: é o on_starting abaixo.
+preload_app = True
+wsgi_app = "app:create_app()"
+
+
+def on_starting(server):
+    # As métricas de cada worker ficam em data/metrics/<pid>.json; um novo
+    # master começa do zero para não somar arquivos de execuções anteriores.
+    shutil.rmtree(os.path.join(os.path.abspath("./data"), "metrics"), ignore_errors=True)
+    # Boot no master, antes do fork, mesmo com `gunicorn app:app` na linha de
+    # comando (que substitui o wsgi_app): os workers herdam tudo pronto.
+    from app import create_app
+    create_app()
+
+
+def post_fork(server, worker):
+    worker.boot_started = time.monotonic()
+
+
+def post_worker_init(worker):
+    # Tempo entre o fork e o worker pronto para aceitar conexões (exposto em /ready).
+    from app import _boot
+    _boot["worker_boot_seconds"] = round(time.monotonic() - worker.boot_started, 4)
+    worker.log.info("Worker pronto em %.4fs", _boot["worker_boot_seconds"])
+
+
+def worker_exit(server, worker):
+    # Grava o que estiver na fila do histórico antes do worker morrer.
+    # Depois, a última gravação das métricas (o arquivo continua contando no /metrics).
+    from app import _history_writer, flush_metrics
+    _history_writer.stop()
+    flush_metrics()
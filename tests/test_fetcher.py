@@ -0,0 +1,88 @@
+"""fetch_url: 200 -> fresh -> 304 -> offline, contra um servidor HTTP local."""
+import importlib
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BODY = b"<html><body><main><p>Art. 1 Texto da fonte oficial.</p></main></body></html>"
+ETAG = '"v1"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    hits = []
+
+    def do_GET(self):
+        self.hits.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.send_header("ETag", ETAG)
+        self.send_header("Last-Modified", "Mon, 05 Oct 2026 12:00:00 GMT")
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    # DATA_DIR é relativo ao cwd no import: não mexe no data/ do repositório.
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("cwd"))
+    sys.path.insert(0, REPO_DIR)
+    try:
+        yield importlib.import_module("app")
+    finally:
+        sys.path.remove(REPO_DIR)
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def server():
+    _Handler.hits = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch_url_cache_cycle(app_module, server, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, "FETCH_CACHE_DIR", str(tmp_path))
+    url = f"http://127.0.0.1:{server.server_address[1]}/fonte"
+
+    first = app_module.fetch_url(url, min_interval=3600)
+    assert (first["status"], first["changed"]) == ("fetched", True)
+    assert first["content_type"].startswith("text/html")
+    with open(first["path"], "rb") as f:
+        assert f.read() == BODY
+
+    # Checado há pouco: nem chega a fazer request.
+    fresh = app_module.fetch_url(url, min_interval=3600)
+    assert (fresh["status"], fresh["changed"]) == ("fresh", False)
+    assert _Handler.hits == [None]
+
+    # Revalidação condicional: 304 com o ETag guardado.
+    not_modified = app_module.fetch_url(url, min_interval=0)
+    assert (not_modified["status"], not_modified["changed"]) == ("not_modified", False)
+    assert _Handler.hits == [None, ETAG]
+
+    # Servidor fora do ar: devolve a cópia do cache.
+    server.shutdown()
+    server.server_close()
+    offline = app_module.fetch_url(url, min_interval=0)
+    assert (offline["status"], offline["changed"]) == ("offline", False)
+    with open(offline["path"], "rb") as f:
+        assert f.read() == BODY